@@ -0,0 +1,258 @@
+"""Vectorized boids engine.
+
+`VectorizedFlock` keeps the position and velocity of every boid in NumPy
+arrays and advances the whole flock at once, following the same rules as
+`FlockingAgent.change_position` in flocking.py (alignment, separation,
+cohesion, min/max speed clamp, obstacle bounce and wrap-around).
+It bounces off a single circular obstacle (`obstacles.Circle`); scenes with
+many obstacles are only supported by the per-agent version.
+Like `spatial_grid.TorusGrid`, neighbours are found across the wrap-around seam,
+by `cell_pairs`, which `flock_metrics` uses too.
+
+Run this file directly to watch a large flock:
+
+    python Assignment_0/flock_engine.py
+"""
+from vi import Agent, Simulation
+import numpy as np
+
+from sprite_cache import CachedRotation
+
+WIDTH, HEIGHT = 1000, 1000
+MIN_SPEED = 0.5
+
+
+def cell_pairs(pos, radius, width=WIDTH, height=HEIGHT, batch_size=4096):
+    """Find every ordered pair of distinct boids within `radius` on the torus, with a grid of cells.
+
+    Returns `(order, pairs)`: `order` sorts the boids by cell, and `pairs`
+    yields `(i, k, off_x, off_y)` arrays per batch of `batch_size` boids. `i`
+    is the boid, `order[k]` the neighbour (k is its place in cell order, so
+    per-neighbour values are cheap to gather from cell-sorted copies) and the
+    offsets are `neighbour.pos - boid.pos` the shortest way around.
+    """
+    n = len(pos)
+    cols = max(1, int(width // radius))
+    rows = max(1, int(height // radius))
+    cx = (pos[:, 0] * cols // width).astype(int) % cols
+    cy = (pos[:, 1] * rows // height).astype(int) % rows
+    cell = cy * cols + cx
+
+    order = np.argsort(cell, kind="stable")
+    counts = np.bincount(cell, minlength=cols * rows)
+    starts = np.cumsum(counts) - counts
+    rank = np.empty(n, dtype=int)
+    rank[order] = np.arange(n)
+
+    # Gathering from contiguous, cell-sorted copies is much cheaper than from (n, 2) arrays
+    x, y = pos[:, 0], pos[:, 1]
+    sorted_x, sorted_y = x[order], y[order]
+
+    # On tiny grids -1 and +1 can wrap onto the same cell, which must only be visited once
+    col_steps = {step % cols for step in (-1, 0, 1)}
+    row_steps = {step % rows for step in (-1, 0, 1)}
+
+    def pairs():
+        for lo in range(0, n, batch_size):
+            boids = np.arange(lo, min(lo + batch_size, n))
+            for dx in col_steps:
+                for dy in row_steps:
+                    neighbour_cell = ((cy[boids] + dy) % rows) * cols + (cx[boids] + dx) % cols
+                    per_boid = counts[neighbour_cell]
+
+                    # Expand every boid into one (boid, candidate) pair per agent in the cell
+                    i = np.repeat(boids, per_boid)
+                    first = np.repeat(starts[neighbour_cell] - (np.cumsum(per_boid) - per_boid), per_boid)
+                    k = first + np.arange(len(i))
+
+                    off_x = sorted_x[k] - np.repeat(x[boids], per_boid)
+                    off_y = sorted_y[k] - np.repeat(y[boids], per_boid)
+                    off_x -= width * np.round(off_x / width)
+                    off_y -= height * np.round(off_y / height)
+                    hit = (off_x * off_x + off_y * off_y <= radius * radius) & (k != np.repeat(rank[boids], per_boid))
+                    yield i[hit], k[hit], off_x[hit], off_y[hit]
+
+    return order, pairs()
+
+
+class VectorizedFlock:
+    def __init__(self, config, count=0, obstacle=None, seed=None, pos=None, move=None, batch_size=4096):
+        self.config = config
+        self.obstacle = obstacle
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+
+        if pos is None:
+            pos = self.rng.uniform((0, 0), (WIDTH, HEIGHT), size=(count, 2))
+        if move is None:
+            angles = self.rng.uniform(0, 2 * np.pi, size=len(pos))
+            move = np.column_stack((np.cos(angles), np.sin(angles))) * config.movement_speed
+
+        self.pos = np.array(pos, dtype=float)
+        self.move = np.array(move, dtype=float)
+
+    def __len__(self):
+        return len(self.pos)
+
+    # ------------------------------
+    # NEIGHBOUR SEARCH
+    # ------------------------------
+    def neighbor_sums(self):
+        """Return, per boid, the neighbour count and the summed offsets and velocities of its neighbours.
+
+        Offsets are `neighbor.pos - boid.pos`, so the average neighbour position is
+        `pos + offset_sum / count`. Only the (wrapped) 3x3 block of cells around a boid is scanned,
+        and offsets take the shortest way around the torus.
+        """
+        n = len(self.pos)
+        order, pairs = cell_pairs(self.pos, self.config.radius, batch_size=self.batch_size)
+        sorted_vx, sorted_vy = self.move[order, 0], self.move[order, 1]
+
+        count = np.zeros(n)
+        offset_sum = np.zeros((n, 2))
+        move_sum = np.zeros((n, 2))
+        for i, k, off_x, off_y in pairs:
+            count += np.bincount(i, minlength=n)
+            offset_sum[:, 0] += np.bincount(i, weights=off_x, minlength=n)
+            offset_sum[:, 1] += np.bincount(i, weights=off_y, minlength=n)
+            move_sum[:, 0] += np.bincount(i, weights=sorted_vx[k], minlength=n)
+            move_sum[:, 1] += np.bincount(i, weights=sorted_vy[k], minlength=n)
+
+        return count, offset_sum, move_sum
+
+    # ------------------------------
+    # STEP
+    # ------------------------------
+    def step(self):
+        """Advance every boid by one tick."""
+        config = self.config
+        count, offset_sum, move_sum = self.neighbor_sums()
+        lonely = count == 0
+        flocking = ~lonely
+
+        # Boids without neighbours keep drifting (and get a nudge when they stalled)
+        stalled = lonely & (np.linalg.norm(self.move, axis=1) < 0.01)
+        if stalled.any():
+            angles = self.rng.uniform(0, 2 * np.pi, size=stalled.sum())
+            self.move[stalled] = np.column_stack((np.cos(angles), np.sin(angles))) * 0.5
+
+        safe_count = np.maximum(count, 1)[:, None]
+        x_avg = self.pos + offset_sum / safe_count
+        v_avg = move_sum / safe_count
+
+        # Like the per-agent version, only boids with neighbours bounce off the obstacle
+        if self.obstacle is not None:
+            self._bounce(flocking)
+
+        alignment = v_avg - self.move
+        separation = self.pos - x_avg
+        cohesion = (x_avg - self.pos) - self.move
+
+        α, β, γ = config.alignment_weight, config.separation_weight, config.cohesion_weight
+        f_total = (α * alignment + β * separation + γ * cohesion) / config.mass
+        move = self.move + f_total
+
+        # Clamp velocity
+        speed = np.linalg.norm(move, axis=1)
+        clamped = np.clip(speed, MIN_SPEED, config.max_velocity)
+        scale = np.divide(clamped, speed, out=np.ones_like(speed), where=speed > 0)
+        move *= scale[:, None]
+
+        self.move[flocking] = move[flocking]
+        self.pos += self.move * config.delta_time
+        self._wrap_position()
+
+    def _bounce(self, mask):
+        """Reflect the velocity of boids inside the obstacle and push them onto its edge."""
+        obstacle = self.obstacle
+        center = np.array((obstacle.pos.x, obstacle.pos.y))
+        avoid_distance = obstacle.radius + self.config.radius
+
+        offset = self.pos - center
+        distance = np.linalg.norm(offset, axis=1)
+        hit = mask & (distance < avoid_distance)
+        if not hit.any():
+            return
+
+        offset, distance = offset[hit], distance[hit]
+        centered = distance == 0
+        if centered.any():
+            offset[centered] = self.rng.uniform(-1, 1, size=(centered.sum(), 2))
+            distance[centered] = np.linalg.norm(offset[centered], axis=1)
+
+        normal = offset / distance[:, None]
+        move = self.move[hit]
+        self.move[hit] = move - 2 * np.einsum("ij,ij->i", move, normal)[:, None] * normal
+        self.pos[hit] = center + normal * avoid_distance
+
+    def _wrap_position(self):
+        self.pos[:, 0] %= WIDTH
+        self.pos[:, 1] %= HEIGHT
+
+
+# ------------------------------
+# VIOLET INTEGRATION
+# ------------------------------
+class ArrayBoid(CachedRotation, Agent):
+    """A boid whose position is written by `VectorizedFlockingSimulation`."""
+
+    def change_position(self):
+        pass
+
+
+class VectorizedFlockingSimulation(Simulation):
+    """Windowed `Simulation` that moves all `ArrayBoid`s with one `VectorizedFlock` step per tick."""
+
+    def __init__(self, config, obstacle=None, seed=None):
+        super().__init__(config)
+        self.obstacle = obstacle
+        self.seed = seed
+        self.boids = []
+        self.flock = None
+
+    def spawn_flock(self, count, images):
+        self.batch_spawn_agents(count, ArrayBoid, images=images)
+        self.boids = [agent for agent in self._agents if isinstance(agent, ArrayBoid)]
+        self.flock = VectorizedFlock(
+            self.config,
+            obstacle=self.obstacle,
+            seed=self.seed,
+            pos=[(agent.pos.x, agent.pos.y) for agent in self.boids],
+            move=[(agent.move.x, agent.move.y) for agent in self.boids],
+        )
+        return self
+
+    def before_update(self):
+        super().before_update()
+        if self.flock is None:
+            return
+
+        self.flock.step()
+        for agent, pos, move in zip(self.boids, self.flock.pos.tolist(), self.flock.move.tolist()):
+            agent.pos.update(pos)
+            agent.move.update(move)
+
+
+if __name__ == "__main__":
+    from flocking import FlockingConfig
+    from lod_render import use_lod_renderer
+    from obstacles import Circle
+
+    (
+        use_lod_renderer(
+            VectorizedFlockingSimulation(
+                FlockingConfig(
+                    image_rotation=True,
+                    movement_speed=2.0,
+                    radius=80,
+                    fps_limit=0,
+                    print_fps=True,
+                ),
+                obstacle=Circle((500, 500), radius=100),
+            ),
+            # Draw the boids as dots once there are too many to blit
+            {"ArrayBoid": 5000},
+        )
+        .spawn_flock(10_000, images=["Assignment_0/images/triangle.png"])
+        .run()
+    )
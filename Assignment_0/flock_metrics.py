@@ -0,0 +1,145 @@
+"""Streaming order parameters for flocking runs.
+
+Every `every` frames, `FlockMetrics` reduces the whole flock to one row:
+
+- polarization: length of the average heading, 1 when all boids fly the same way;
+- mean_speed: average length of `move`;
+- nn_p10 / nn_p50 / nn_p90: quantiles of the distance to the nearest neighbour,
+  over the boids that have one within `radius`;
+- isolated: fraction of boids without any neighbour within `radius`;
+- flocks: number of groups of at least `min_flock_size` boids that are
+  connected by neighbours within `radius`.
+
+Rows are kept in a small NumPy buffer instead of snapshots of every agent, so
+long runs only cost a few bytes per recorded frame:
+
+    sim = use_flock_metrics(Simulation(config), every=10)
+    sim.run()
+    sim.flock_metrics.to_frame().write_csv("metrics.csv")
+"""
+import numpy as np
+import polars as pl
+
+from flock_engine import WIDTH, HEIGHT, cell_pairs
+
+
+def neighbour_pairs(pos, radius, width=WIDTH, height=HEIGHT, batch_size=4096):
+    """Yield `(i, j, distance)` arrays for every ordered pair of boids within `radius` on the torus."""
+    order, pairs = cell_pairs(pos, radius, width, height, batch_size)
+    for i, k, off_x, off_y in pairs:
+        yield i, order[k], np.hypot(off_x, off_y)
+
+
+def connected_groups(n, i, j):
+    """Label every boid with the smallest index in its connected group (edges `i`-`j`)."""
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[i], labels[j])
+        merged = labels.copy()
+        np.minimum.at(merged, i, low)
+        np.minimum.at(merged, j, low)
+        # Pointer jumping: follow labels to their own label, so long chains collapse quickly
+        merged = merged[merged]
+        if np.array_equal(merged, labels):
+            return labels
+        labels = merged
+
+
+def order_parameters(pos, move, radius, min_flock_size=2, width=WIDTH, height=HEIGHT):
+    """Reduce one frame of the flock to the values of `FlockMetrics.COLUMNS` (without the frame)."""
+    n = len(pos)
+    if n == 0:
+        return 0.0, 0.0, np.nan, np.nan, np.nan, 0.0, 0
+
+    speed = np.hypot(move[:, 0], move[:, 1])
+    moving = speed > 0
+    headings = move[moving] / speed[moving, None]
+    polarization = np.hypot(*headings.mean(axis=0)) if moving.any() else 0.0
+
+    nearest = np.full(n, np.inf)
+    edges_i, edges_j = [], []
+    for i, j, distance in neighbour_pairs(pos, radius, width, height):
+        np.minimum.at(nearest, i, distance)
+        # Every edge shows up in both directions, one is enough to find the groups
+        forward = i < j
+        edges_i.append(i[forward])
+        edges_j.append(j[forward])
+
+    has_neighbour = np.isfinite(nearest)
+    if has_neighbour.any():
+        p10, p50, p90 = np.quantile(nearest[has_neighbour], (0.1, 0.5, 0.9))
+    else:
+        p10 = p50 = p90 = np.nan
+
+    labels = connected_groups(n, np.concatenate(edges_i), np.concatenate(edges_j))
+    sizes = np.bincount(labels, minlength=n)
+    flocks = int((sizes >= min_flock_size).sum())
+
+    return polarization, speed.mean(), p10, p50, p90, 1 - has_neighbour.mean(), flocks
+
+
+class FlockMetrics:
+    COLUMNS = ("frame", "polarization", "mean_speed", "nn_p10", "nn_p50", "nn_p90", "isolated", "flocks")
+
+    def __init__(self, radius, every=10, min_flock_size=2, width=WIDTH, height=HEIGHT):
+        self.radius = radius
+        self.every = every
+        self.min_flock_size = min_flock_size
+        self.width = width
+        self.height = height
+        self.rows = np.empty((64, len(self.COLUMNS)))
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def record(self, frame, pos, move):
+        """Append the order parameters of one frame, given `(n, 2)` arrays of positions and velocities."""
+        if self.size == len(self.rows):
+            # Double the buffer, so appending stays cheap on average
+            self.rows = np.concatenate((self.rows, np.empty_like(self.rows)))
+
+        values = order_parameters(
+            np.asarray(pos, dtype=float).reshape(-1, 2),
+            np.asarray(move, dtype=float).reshape(-1, 2),
+            self.radius,
+            self.min_flock_size,
+            self.width,
+            self.height,
+        )
+        self.rows[self.size] = (frame, *values)
+        self.size += 1
+
+    def to_frame(self):
+        data = {name: self.rows[:self.size, column] for column, name in enumerate(self.COLUMNS)}
+        return pl.DataFrame(data).with_columns(pl.col("frame", "flocks").cast(pl.Int64))
+
+
+def use_flock_metrics(simulation, every=10, min_flock_size=2, width=WIDTH, height=HEIGHT):
+    """Record order parameters into `simulation.flock_metrics` every `every` frames and return the simulation.
+
+    Simulations with a `VectorizedFlock` (`simulation.flock`) are read from its arrays directly.
+    """
+    metrics = FlockMetrics(simulation.config.radius, every, min_flock_size, width, height)
+    simulation.flock_metrics = metrics
+    after_update = simulation.after_update
+
+    def measuring_after_update():
+        after_update()
+        frame = simulation.shared.counter
+        if frame % metrics.every:
+            return
+
+        flock = getattr(simulation, "flock", None)
+        if flock is not None:
+            metrics.record(frame, flock.pos, flock.move)
+        else:
+            agents = simulation._agents.sprites()
+            metrics.record(
+                frame,
+                [(agent.pos.x, agent.pos.y) for agent in agents],
+                [(agent.move.x, agent.move.y) for agent in agents],
+            )
+
+    simulation.after_update = measuring_after_update
+    return simulation
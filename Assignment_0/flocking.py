@@ -1,9 +1,19 @@
 from dataclasses import dataclass
 from vi import Agent, Config, Simulation
 from pygame.math import Vector2
-from vi.config import deserialize
+try:
+    from vi.config import deserialize
+except ImportError:
+    # Violet 0.3 has no serde decorator, its configs are plain dataclasses
+    def deserialize(cls):
+        return cls
 import random
 import pygame
+from spatial_grid import use_torus_grid
+from sprite_cache import CachedRotation
+from obstacles import load_scene
+from double_buffer import apply_state
+from overlay import use_static_overlay
 
 @deserialize
 @dataclass
@@ -23,55 +33,47 @@ class FlockingConfig(Config):
         )
 
 
-# Obstacle definition (not visible by itself)
-class Obstacle:
-    def __init__(self, pos: Vector2, image_path: str, radius: float):
-        self.pos = pos
-        self.radius = radius
-        self.image_path = image_path
-
-
 # Main agent with flocking + obstacle avoidance
-class FlockingAgent(Agent):
-    obstacle = None  # Shared by all agents
+class FlockingAgent(CachedRotation, Agent):
+    obstacles = None  # ObstacleField shared by all agents
+    double_buffered = False  # Set by double_buffer.use_double_buffer
 
     def change_position(self):
+        # With a double buffer, the simulation applies `next_state` to all agents at once
+        if not self.double_buffered:
+            apply_state(self, self.next_state())
+
+    def next_state(self):
+        """Position and velocity for the next frame, computed without changing this agent."""
         neighbors = self.in_proximity_accuracy()
         neighbors = [agent for agent, _ in neighbors]
+        pos, move = Vector2(self.pos), Vector2(self.move)
 
         if not neighbors:
-            if self.move.length() < 0.01:
+            if move.length() < 0.01:
                 angle = random.uniform(0, 360)
-                self.move = Vector2(1, 0).rotate(angle) * 0.5
-            self.pos += self.move * self.config.delta_time
-            self._wrap_position()
-            return
+                move = Vector2(1, 0).rotate(angle) * 0.5
+            pos += move * self.config.delta_time
+            return {"pos": self._wrap(pos), "move": move}
 
         # Obstacle avoidance
-        # Obstacle collision handling (hard boundary)
-        obstacle = FlockingAgent.obstacle
-        if obstacle:
-            offset = self.pos - obstacle.pos
-            distance = offset.length()
-            avoid_distance = obstacle.radius + self.config.radius
+        # Obstacle collision handling (hard boundary), only for the obstacles listed in our cell
+        obstacles = FlockingAgent.obstacles
+        if obstacles:
+            for obstacle in obstacles.near(pos):
+                hit = obstacle.contact(pos, obstacles.margin)
+                if hit:
+                    normal, surface = hit
 
-            if distance < avoid_distance:
-                if distance == 0:
-                    offset = Vector2(random.uniform(-1, 1), random.uniform(-1, 1))
-                    distance = offset.length()
+                    # Reflect velocity off the obstacle
+                    move = move.reflect(normal)
 
-                # Normalize the bounce direction
-                normal = offset.normalize()
+                    # Move agent just outside the obstacle
+                    pos = surface
 
-                # Reflect velocity off the obstacle
-                self.move = self.move.reflect(normal)
 
-                # Move agent just outside the obstacle radius
-                self.pos = obstacle.pos + normal * avoid_distance
-
-
-        v_boid = self.move
-        x_boid = self.pos
+        v_boid = move
+        x_boid = pos
 
         # Alignment
         v_avg = sum((agent.move for agent in neighbors), Vector2()) / len(neighbors)
@@ -93,61 +95,55 @@ class FlockingAgent(Agent):
         max_speed = self.config.max_velocity
 
         f_total = (α * alignment + β * separation + γ * cohesion) / mass
-        self.move += f_total
+        move += f_total
 
         # Clamp velocity
-        speed = self.move.length()
+        speed = move.length()
         min_speed = 0.5
         if speed < min_speed:
-            self.move = self.move.normalize() * min_speed
+            move = move.normalize() * min_speed
         elif speed > max_speed:
-            self.move = self.move.normalize() * max_speed
+            move = move.normalize() * max_speed
 
-        self.pos += self.move * delta_time
-        self._wrap_position()
+        pos += move * delta_time
+        return {"pos": self._wrap(pos), "move": move}
 
-    def _wrap_position(self):
+    @staticmethod
+    def _wrap(pos):
         width, height = 1000, 1000
-        self.pos.x %= width
-        self.pos.y %= height
-
-
-# Obstacle agent (visible but doesn't move)
-class ObstacleAgent(Agent):
-    def initialise_agent(self):
-         self.pos = FlockingAgent.obstacle.pos - Vector2(80, 71)
-
-    def change_position(self):
-        pass
-
-
-# Create the obstacle and assign it to agents
-obstacle = Obstacle(Vector2(500, 500), "Assignment_0/images/triangle@200px.png", radius=100)
-FlockingAgent.obstacle = obstacle
+        pos.x %= width
+        pos.y %= height
+        return pos
 
 
-# Start the simulation
-sim = Simulation(
-    FlockingConfig(
+if __name__ == "__main__":
+    config = FlockingConfig(
         image_rotation=True,
         movement_speed=2.0,
         radius=80,
         fps_limit=0,
     )
-)
-
-# Spawn visible obstacle agent (1 only)
-# Add the visual obstacle
-sim.batch_spawn_agents(
-    1,
-    ObstacleAgent,
-    images=["Assignment_0/images/triangle@200px.png"]
-)
-
-# Add the flocking agents
-sim.batch_spawn_agents(
-    100,
-    FlockingAgent,
-    images=["Assignment_0/images/triangle.png"]  # or triangle@50px.png
-).run()
 
+    # Load the obstacles and assign them to agents (or scenes/pillars.json for a whole arena)
+    # Agents are kept one perception radius away, unless the scene sets its own margin
+    FlockingAgent.obstacles = load_scene("Assignment_0/scenes/triangle.json", margin=config.radius)
+
+
+    # Start the simulation
+    # (swap in spatial_grid.use_verlet_grid to reuse neighbour lists across frames,
+    #  wrap in double_buffer.use_double_buffer to move all agents synchronously,
+    #  and in flock_metrics.use_flock_metrics to record polarization etc. in sim.flock_metrics)
+    sim = use_torus_grid(Simulation(config))
+
+    # Add the visual obstacles: sprites centred on their obstacle, outlines for the rest
+    for obstacle in FlockingAgent.obstacles.obstacles:
+        if obstacle.image_path:
+            sim.spawn_obstacle(obstacle.image_path, obstacle.pos.x, obstacle.pos.y)
+    use_static_overlay(sim, FlockingAgent.obstacles.draw)
+
+    # Add the flocking agents
+    sim.batch_spawn_agents(
+        100,
+        FlockingAgent,
+        images=["Assignment_0/images/triangle.png"]  # or triangle@50px.png
+    ).run()
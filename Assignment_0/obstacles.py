@@ -0,0 +1,284 @@
+"""Static obstacles and a broadphase grid to look them up.
+
+A scene file lists the obstacles of an arena as JSON:
+
+    {
+        "margin": 10,
+        "obstacles": [
+            {"shape": "circle", "pos": [500, 500], "radius": 100, "image": "Assignment_0/images/triangle@200px.png"},
+            {"shape": "polygon", "points": [[100, 100], [180, 100], [140, 170]]},
+            {"shape": "sprite", "pos": [800, 300], "image": "Assignment_0/images/triangle@200px.png"}
+        ]
+    }
+
+A sprite obstacle takes the shape of the opaque pixels of its image. Its
+signed distance field is computed once per image and cached on disk.
+
+`load_scene` turns it into an `ObstacleField`: a grid that stores, per cell,
+the ids of every obstacle within `margin` of that cell. Obstacles never move,
+so the grid is built once and an agent only tests the few obstacles listed in
+its own cell instead of every obstacle in the arena.
+
+`margin` is how far agents are kept away from an obstacle's outline. A scene
+may set its own, e.g. when its pillars are closer together than the default.
+"""
+import hashlib
+import json
+import math
+import os
+import random
+
+import numpy as np
+import pygame
+from pygame.math import Vector2
+
+WIDTH, HEIGHT = 1000, 1000
+SDF_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sdf_cache")
+
+
+class Circle:
+    def __init__(self, pos, radius, image_path=None):
+        self.pos = Vector2(pos)
+        self.radius = radius
+        self.image_path = image_path
+
+    def bounds(self):
+        return (self.pos.x - self.radius, self.pos.y - self.radius,
+                self.pos.x + self.radius, self.pos.y + self.radius)
+
+    def contact(self, pos, margin):
+        """Return `(normal, surface)` if `pos` is within `margin` of the circle, else None.
+
+        `surface` is where an agent has to be put to be exactly `margin` away.
+        """
+        offset = pos - self.pos
+        distance = offset.length()
+        avoid_distance = self.radius + margin
+        if distance >= avoid_distance:
+            return None
+
+        if distance == 0:
+            offset = Vector2(random.uniform(-1, 1), random.uniform(-1, 1))
+
+        normal = offset.normalize()
+        return normal, self.pos + normal * avoid_distance
+
+    def draw(self, surface, colour):
+        pygame.draw.circle(surface, colour, self.pos, self.radius, width=1)
+
+
+class Polygon:
+    def __init__(self, points, image_path=None):
+        self.points = [Vector2(point) for point in points]
+        self.pos = sum(self.points, Vector2()) / len(self.points)
+        self.image_path = image_path
+
+    def bounds(self):
+        xs = [point.x for point in self.points]
+        ys = [point.y for point in self.points]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def _edges(self):
+        return zip(self.points, self.points[1:] + self.points[:1])
+
+    def _contains(self, pos):
+        # Even-odd ray casting
+        inside = False
+        for a, b in self._edges():
+            if (a.y > pos.y) != (b.y > pos.y):
+                x = a.x + (pos.y - a.y) * (b.x - a.x) / (b.y - a.y)
+                if pos.x < x:
+                    inside = not inside
+        return inside
+
+    def _closest(self, pos):
+        """Closest point on the outline, and the edge it lies on."""
+        best, best_edge, best_distance = None, None, math.inf
+        for a, b in self._edges():
+            edge = b - a
+            length_sq = edge.length_squared()
+            t = 0 if length_sq == 0 else max(0, min(1, (pos - a).dot(edge) / length_sq))
+            point = a + edge * t
+            distance = pos.distance_to(point)
+            if distance < best_distance:
+                best, best_edge, best_distance = point, edge, distance
+        return best, best_edge, best_distance
+
+    def contact(self, pos, margin):
+        """Return `(normal, surface)` if `pos` is inside or within `margin` of the polygon, else None."""
+        closest, edge, distance = self._closest(pos)
+        inside = self._contains(pos)
+        if not inside and distance >= margin:
+            return None
+
+        if distance == 0:
+            # Exactly on the outline: push out perpendicular to the edge, away from the centre
+            normal = Vector2(-edge.y, edge.x).normalize()
+            if normal.dot(closest - self.pos) < 0:
+                normal = -normal
+        else:
+            normal = (pos - closest).normalize()
+            if inside:
+                normal = -normal
+
+        return normal, closest + normal * margin
+
+    def draw(self, surface, colour):
+        pygame.draw.polygon(surface, colour, self.points, width=1)
+
+
+def signed_distance_field(alpha, pad, threshold=128):
+    """Distance in pixels from every pixel to the outline of the opaque area, negative inside.
+
+    `alpha` is indexed `[x, y]` like pygame's surfarray. The field gets `pad`
+    (at least 1) extra pixels on every side, so it also covers the area around the image.
+    """
+    solid = np.pad(alpha >= threshold, pad)
+    # The outline: solid pixels with at least one empty 4-neighbour (the padding keeps np.roll from wrapping)
+    interior = solid.copy()
+    for axis in (0, 1):
+        for shift in (-1, 1):
+            interior &= np.roll(solid, shift, axis)
+    edge_x, edge_y = np.nonzero(solid & ~interior)
+
+    xs, ys = np.indices(solid.shape)
+    xs, ys = xs.ravel(), ys.ravel()
+    distance_sq = np.full(xs.size, np.inf)
+    for lo in range(0, len(edge_x), 32):
+        dx = xs[:, None] - edge_x[None, lo:lo + 32]
+        dy = ys[:, None] - edge_y[None, lo:lo + 32]
+        distance_sq = np.minimum(distance_sq, (dx * dx + dy * dy).min(axis=1))
+
+    distance = np.sqrt(distance_sq).reshape(solid.shape)
+    return np.where(solid, -distance, distance)
+
+
+def load_sdf(image_path, pad):
+    """Signed distance field and its gradient for an image, cached on disk by the hash of the image."""
+    with open(image_path, "rb") as file:
+        digest = hashlib.sha1(file.read()).hexdigest()
+
+    cache_path = os.path.join(SDF_CACHE, f"{digest}-{pad}.npz")
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            return cached["sdf"], cached["grad_x"], cached["grad_y"]
+
+    alpha = pygame.surfarray.array_alpha(pygame.image.load(image_path))
+    sdf = signed_distance_field(alpha, pad).astype(np.float32)
+    grad_x, grad_y = np.gradient(sdf)
+
+    # Written under another name first, so a process that loads the cache while another one (e.g. a sweep
+    # worker) writes it never reads half a file
+    os.makedirs(SDF_CACHE, exist_ok=True)
+    partial = f"{cache_path[:-4]}.{os.getpid()}.npz"
+    np.savez_compressed(partial, sdf=sdf, grad_x=grad_x, grad_y=grad_y)
+    os.replace(partial, cache_path)
+    return sdf, grad_x, grad_y
+
+
+class Sprite:
+    """Obstacle shaped like the opaque pixels of its image, centred on `pos` like violet's obstacles.
+
+    The distance field reaches `margin` past the image, so `contact` is a single array lookup.
+    """
+
+    def __init__(self, pos, image_path, margin):
+        self.pos = Vector2(pos)
+        self.image_path = image_path
+        self.pad = math.ceil(margin) + 2
+        self.sdf, self.grad_x, self.grad_y = load_sdf(image_path, self.pad)
+
+        width, height = self.sdf.shape
+        self.origin = self.pos - Vector2(width, height) / 2
+
+    def bounds(self):
+        width, height = self.sdf.shape
+        return (self.origin.x + self.pad, self.origin.y + self.pad,
+                self.origin.x + width - self.pad, self.origin.y + height - self.pad)
+
+    def contact(self, pos, margin):
+        """Return `(normal, surface)` if `pos` is inside or within `margin` of the opaque pixels, else None."""
+        x = int(pos.x - self.origin.x)
+        y = int(pos.y - self.origin.y)
+        width, height = self.sdf.shape
+        if not (0 <= x < width and 0 <= y < height):
+            return None
+
+        distance = float(self.sdf[x, y])
+        if distance >= margin:
+            return None
+
+        # The gradient of a distance field points away from the outline
+        normal = Vector2(float(self.grad_x[x, y]), float(self.grad_y[x, y]))
+        if normal.length_squared() == 0:
+            normal = Vector2(random.uniform(-1, 1), random.uniform(-1, 1))
+
+        normal = normal.normalize()
+        return normal, pos + normal * (margin - distance)
+
+
+SHAPES = {
+    "circle": lambda entry, margin: Circle(entry["pos"], entry["radius"], entry.get("image")),
+    "polygon": lambda entry, margin: Polygon(entry["points"], entry.get("image")),
+    "sprite": lambda entry, margin: Sprite(entry["pos"], entry["image"], margin),
+}
+
+
+class ObstacleField:
+    """Uniform grid of obstacle ids per cell, for obstacles that never move.
+
+    Every obstacle is registered in all cells that its bounding box, grown by
+    `margin`, overlaps. So any agent that can be within `margin` of an obstacle
+    finds it in `near(pos)`.
+    """
+
+    def __init__(self, obstacles, margin, cell_size=100, width=WIDTH, height=HEIGHT):
+        self.obstacles = list(obstacles)
+        self.margin = margin
+        self.width = width
+        self.height = height
+        self.cols = max(1, int(width // cell_size))
+        self.rows = max(1, int(height // cell_size))
+        self.cell_width = width / self.cols
+        self.cell_height = height / self.rows
+
+        cells = [[] for _ in range(self.cols * self.rows)]
+        for index, obstacle in enumerate(self.obstacles):
+            left, top, right, bottom = obstacle.bounds()
+            first_col, last_col = self._col(left - margin), self._col(right + margin)
+            first_row, last_row = self._row(top - margin), self._row(bottom + margin)
+            for row in range(first_row, last_row + 1):
+                for col in range(first_col, last_col + 1):
+                    cells[row * self.cols + col].append(index)
+
+        self.cells = [tuple(ids) for ids in cells]
+
+    def __len__(self):
+        return len(self.obstacles)
+
+    def _col(self, x):
+        return max(0, min(self.cols - 1, int(x // self.cell_width)))
+
+    def _row(self, y):
+        return max(0, min(self.rows - 1, int(y // self.cell_height)))
+
+    def near(self, pos):
+        """Obstacles that may be within `margin` of `pos`."""
+        cell = self._row(pos.y % self.height) * self.cols + self._col(pos.x % self.width)
+        return [self.obstacles[index] for index in self.cells[cell]]
+
+    def draw(self, surface, colour=(255, 255, 255)):
+        """Outline every obstacle that has no image of its own."""
+        for obstacle in self.obstacles:
+            if obstacle.image_path is None:
+                obstacle.draw(surface, colour)
+
+
+def load_scene(path, margin, cell_size=100, width=WIDTH, height=HEIGHT):
+    """Read a scene file and build the `ObstacleField` for it. A `margin` in the file wins over the argument."""
+    with open(path) as file:
+        scene = json.load(file)
+
+    margin = scene.get("margin", margin)
+    obstacles = [SHAPES[entry["shape"]](entry, margin) for entry in scene["obstacles"]]
+    return ObstacleField(obstacles, margin, cell_size, width, height)
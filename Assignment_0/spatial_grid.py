@@ -0,0 +1,580 @@
+"""Uniform-grid proximity engine for a wrap-around (torus) world.
+
+`TorusGrid` is a drop-in replacement for violet's `ProximityEngine`:
+
+- cells are (at least) one `radius` wide, so a query only scans the 3x3 block
+  of cells around the agent instead of a growing list of candidates;
+- cells wrap around the edges and distances take the shortest way around the
+  seam, so agents near an edge see their neighbours on the other side.
+
+Install it on any (Headless)Simulation before running it:
+
+    sim = use_torus_grid(HeadlessSimulation(config))
+
+The torus is the simulation window: violet's default `change_position`
+teleports agents that leave it to the opposite edge.
+
+`VerletGrid` is the opt-in cached variant (`use_verlet_grid`): it keeps a
+neighbour list per agent, built with `radius + skin`, and only rebuilds it
+once agents have moved far enough for the list to go stale.
+
+Every agent class has an index of its own, cells with only agents of that
+class, so a query for one kind never looks at the agents of other kinds.
+Agents that mix in `GridAgent` get queries that violet does not have:
+
+- `self.in_proximity_accuracy(kind=Prey)` only scans the indexes of `Prey`
+  (and its subclasses), where `.filter_kind(Prey)` gets every neighbour first;
+- `self.in_proximity_kinds(Castle, Prey)` splits the neighbours by kind in one
+  scan of the grid, instead of one full scan per `filter_kind`;
+- both take a `radius` (per kind for `in_proximity_kinds`) that differs from
+  the configured one. Only the cells within reach are visited, so a small
+  radius scans less and a large one still finds everything within it;
+- `self.nearest(Prey, k=1, max_radius=...)` finds the nearest agents of a kind
+  by searching outwards ring by ring, instead of sorting every neighbour.
+
+Boolean attributes declared as a `Flag` (`in_castle = Flag()` in the class
+body) are indexed too: the index of a class is split by which flags its agents
+have set, and setting a flag moves the agent to the matching part at once.
+Every query above takes `flags={"in_castle": False}` to only scan the parts
+that match, so sheltered prey are skipped without looking at them one by one.
+Agents without the flag count as not having it set. A `GridAgent` that is
+killed leaves the grid at once, so later queries in the same frame no longer
+return it.
+
+This file is the canonical copy. Assignment_0 and Assignment_1 import the
+same module from a copy of their own: change it here and copy it over,
+`test_spatial_grid.py` fails while the copies differ.
+"""
+import heapq
+import math
+
+try:
+    from vi.proximity import ProximityIter
+except ImportError:
+    # Violet 0.3 has no ProximityIter, its own queries return plain generators too
+    def ProximityIter(neighbours):
+        return neighbours
+
+NO_FLAGS = frozenset()
+
+
+def _wanted(flags):
+    """`{"in_castle": False}` as the hashable `(name, value)` pairs that `TorusGrid._plan` takes."""
+    return frozenset((name, bool(value)) for name, value in flags.items()) if flags else NO_FLAGS
+
+
+def _has_flags(agent, flags):
+    """Whether the agent's flags are as in `flags`, for engines that cannot filter on them."""
+    return all(bool(getattr(agent, name, False)) == value for name, value in flags.items())
+
+
+class TorusGrid:
+    skin = 0
+    """Extra reach on top of `radius` that the cells have to cover."""
+
+    def __init__(self, agents, radius, width, height):
+        self.agents = agents
+        self.width = width
+        self.height = height
+        self.radius = None
+        self.where = {}  # Agent -> cell it is in, for the agents of the group
+        self.static = {}  # Agent -> cell it is in, for agents outside the group, see `add_static`
+        self.indexes = {}  # (Agent class, its set flags) -> its own cells, a list of agents per cell
+        self.plans = {}  # (Tuple of kinds, wanted flags) -> the indexes to scan for them, see `_plan`
+        self._set_radius(radius)
+
+    def _set_radius(self, radius):
+        """Resize the grid. Called by the simulation every tick, so it is a no-op if nothing changed."""
+        if radius == self.radius:
+            return
+
+        self.radius = radius
+        self.cols = max(1, int(self.width // (radius + self.skin)))
+        self.rows = max(1, int(self.height // (radius + self.skin)))
+        self.cell_width = self.width / self.cols
+        self.cell_height = self.height / self.rows
+        # Used by violet to draw the chunk borders when `visualise_chunks` is on
+        self.chunk_size = int(self.cell_width)
+
+        # The (wrapped) 3x3 block around every cell. Small grids would otherwise visit a cell twice.
+        self.neighbours = []
+        for row in range(self.rows):
+            for col in range(self.cols):
+                block = {
+                    ((row + dy) % self.rows) * self.cols + (col + dx) % self.cols
+                    for dy in (-1, 0, 1)
+                    for dx in (-1, 0, 1)
+                }
+                self.neighbours.append(tuple(block))
+
+        # Start over: static agents go straight back in, the others with the next update
+        self.indexes = {}
+        self.plans = {}
+        self.where = {}
+        for agent in self.static:
+            cell = self.static[agent] = self._cell(agent.pos)
+            self._cells_of(agent)[cell].append(agent)
+
+        self.update()
+
+    def _cell(self, pos):
+        col = int((pos.x % self.width) // self.cell_width) % self.cols
+        row = int((pos.y % self.height) // self.cell_height) % self.rows
+        return row * self.cols + col
+
+    @staticmethod
+    def _span(x, reach, size, count):
+        """Indices of the cells (of `size`, `count` of them around the torus) within `reach` of coordinate x."""
+        first = math.floor((x - reach) / size)
+        last = math.floor((x + reach) / size)
+        if last - first + 1 >= count:
+            return range(count)
+        return [index % count for index in range(first, last + 1)]
+
+    def _block(self, pos, reach):
+        """The cells that can hold agents within `reach` of `pos`, each once."""
+        if reach == self.radius:
+            return self.neighbours[self._cell(pos)]
+
+        cols = self._span(pos.x % self.width, reach, self.cell_width, self.cols)
+        rows = self._span(pos.y % self.height, reach, self.cell_height, self.rows)
+        return [row * self.cols + col for row in rows for col in cols]
+
+    def _cells_of(self, agent, flags=None):
+        """The cells of the index of the agent's class and flags, made when the first such agent shows up."""
+        key = type(agent), getattr(agent, "flags", NO_FLAGS) if flags is None else flags
+        cells = self.indexes.get(key)
+        if cells is None:
+            cells = self.indexes[key] = [[] for _ in range(self.cols * self.rows)]
+            self.plans = {}
+        return cells
+
+    def _plan(self, kinds, flags=NO_FLAGS):
+        """The indexes to scan for `kinds` and `flags`, each with the position of the first kind its class belongs to.
+
+        `flags` holds `(name, value)` pairs. Indexes of agents whose flags do not match are left out.
+        """
+        plan = self.plans.get((kinds, flags))
+        if plan is None:
+            plan = []
+            for (cls, set_flags), cells in self.indexes.items():
+                if any((name in set_flags) != value for name, value in flags):
+                    continue
+                for position, kind in enumerate(kinds):
+                    if issubclass(cls, kind):
+                        plan.append((cells, position))
+                        break
+            self.plans[kinds, flags] = plan
+        return plan
+
+    def reflag(self, agent, old_flags):
+        """Move the agent from the index of its `old_flags` to the one of its current flags."""
+        cell = self.where.get(agent, self.static.get(agent))
+        if cell is not None:
+            self._cells_of(agent, old_flags)[cell].remove(agent)
+            self._cells_of(agent)[cell].append(agent)
+
+    def remove(self, agent):
+        """Take the agent out of the grid now, instead of with the next update (e.g. when it is killed)."""
+        cell = self.where.pop(agent, None)
+        if cell is None:
+            cell = self.static.pop(agent, None)
+        if cell is not None:
+            self._cells_of(agent)[cell].remove(agent)
+
+    def add_static(self, agent):
+        """Keep an agent that stopped moving (and left the agent group, see `dormancy`) in the grid as it is."""
+        cells = self._cells_of(agent)
+        cell = self._cell(agent.pos)
+        old = self.where.pop(agent, None)
+        if old != cell:
+            if old is not None:
+                cells[old].remove(agent)
+            cells[cell].append(agent)
+        self.static[agent] = cell
+
+    def remove_static(self, agent):
+        """Undo `add_static`. The agent stays in its cell until it is back in the group and moves."""
+        cell = self.static.pop(agent, None)
+        if cell is not None:
+            self.where[agent] = cell
+
+    def update(self):
+        """Move the agents that changed cells since the last update, and drop the ones that left the group."""
+        indexes, previous, where = self.indexes, self.where, {}
+        for agent in self.agents.sprites():
+            cell = self._cell(agent.pos)
+            old = previous.pop(agent, None)
+            if old != cell:
+                cells = indexes.get((type(agent), getattr(agent, "flags", NO_FLAGS))) or self._cells_of(agent)
+                if old is not None:
+                    cells[old].remove(agent)
+                cells[cell].append(agent)
+            where[agent] = cell
+
+        # Killed, or removed from the group some other way
+        for agent, cell in previous.items():
+            self._cells_of(agent)[cell].remove(agent)
+        self.where = where
+
+    def distance(self, agent, other):
+        """Distance between two agents, the shortest way around the torus."""
+        dx = abs(other.pos.x - agent.pos.x) % self.width
+        dy = abs(other.pos.y - agent.pos.y) % self.height
+        return math.hypot(min(dx, self.width - dx), min(dy, self.height - dy))
+
+    def _scan(self, agent, plan, reaches):
+        """Yield every other agent in the planned indexes within the reach of its kind, with distance and position."""
+        pos = agent.pos
+        x, y = pos.x, pos.y
+        width, height = self.width, self.height
+        blocks = {}  # Reach -> cells to visit for it
+        for cells, position in plan:
+            reach = reaches[position]
+            block = blocks.get(reach)
+            if block is None:
+                block = blocks[reach] = self._block(pos, reach)
+
+            for cell in block:
+                for other in cells[cell]:
+                    if other is agent:
+                        continue
+
+                    dx = abs(other.pos.x - x) % width
+                    dy = abs(other.pos.y - y) % height
+                    distance = math.hypot(min(dx, width - dx), min(dy, height - dy))
+                    if distance <= reach:
+                        yield other, distance, position
+
+    def _accurate_retrieval(self, agent, kind, radius, flags):
+        if agent.is_alive():
+            for other, distance, _ in self._scan(agent, self._plan((kind,), flags), (radius or self.radius,)):
+                yield other, distance
+
+    def in_proximity_accuracy(self, agent, kind=object, radius=None, flags=None):
+        """The agents within `radius` (the grid's by default), or only those of `kind`, which skips other indexes.
+
+        A smaller radius visits fewer cells, a larger one visits as many as it
+        needs to. `flags` (e.g. `{"in_castle": False}`) skips the agents whose
+        flags differ.
+        """
+        return ProximityIter(self._accurate_retrieval(agent, kind, radius, _wanted(flags)))
+
+    def in_proximity_kinds(self, agent, kinds, radius=None, flags=None):
+        """The agents within `radius`, split by kind in one scan: a list of `(agent, distance)` per kind.
+
+        An agent ends up in the list of the first kind it is an instance of,
+        agents of none of the kinds are left out. `radius` is one radius for
+        all kinds or a radius per kind, None meaning the grid's radius.
+        `flags` applies to all kinds.
+        """
+        groups = [[] for _ in kinds]
+        if not agent.is_alive():
+            return groups
+
+        if radius is None or isinstance(radius, (int, float)):
+            radius = [radius] * len(kinds)
+        reaches = [reach or self.radius for reach in radius]
+        for other, distance, position in self._scan(agent, self._plan(tuple(kinds), _wanted(flags)), reaches):
+            groups[position].append((other, distance))
+        return groups
+
+    @staticmethod
+    def _ring(ring):
+        """Column and row offsets of the cells `ring` (> 0) steps away from a cell."""
+        offsets = [(dx, dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+        return offsets + [(dx, dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+
+    def nearest(self, agent, kind=object, k=1, max_radius=None, select=None, flags=None):
+        """The (up to) `k` agents of `kind` nearest to the agent, as `(agent, distance)` pairs, nearest first.
+
+        Looks at ring after ring of cells around the agent's cell and stops as
+        soon as no unvisited cell can hold anything nearer than the k-th agent
+        found, or than `max_radius`. Agents whose flags differ from `flags`,
+        or for which `select(agent)` is false, do not count.
+        """
+        plan = self._plan((kind,), _wanted(flags))
+        if not agent.is_alive() or not plan or k <= 0:
+            return []
+
+        pos = agent.pos
+        x, y = pos.x % self.width, pos.y % self.height
+        width, height, cols, rows = self.width, self.height, self.cols, self.rows
+        limit = math.inf if max_radius is None else max_radius
+        col = int(x // self.cell_width) % cols
+        row = int(y // self.cell_height) % rows
+
+        # Anything `ring` cells away is at least `margin` (to the nearest edge of the agent's cell) plus
+        # `ring - 1` cells away
+        fx, fy = x - col * self.cell_width, y - row * self.cell_height
+        margin = min(fx, self.cell_width - fx, fy, self.cell_height - fy)
+        step = min(self.cell_width, self.cell_height)
+
+        # Rings 0 and 1 are the 3x3 block. Far enough out, rings wrap around the torus onto cells visited before.
+        ring_cells = self.neighbours[row * cols + col]
+        seen = set(ring_cells)
+        found = []
+        for ring in range(1, max(cols, rows) // 2 + 2):
+            if ring > 1:
+                bound = margin + (ring - 1) * step
+                if bound > limit or (len(found) >= k and found[k - 1][0] <= bound):
+                    break
+
+                fresh = []
+                for dx, dy in self._ring(ring):
+                    cell = ((row + dy) % rows) * cols + (col + dx) % cols
+                    if cell not in seen:
+                        seen.add(cell)
+                        fresh.append(cell)
+                ring_cells = fresh
+
+            for cells, _ in plan:
+                for cell in ring_cells:
+                    for other in cells[cell]:
+                        if other is agent or (select is not None and not select(other)):
+                            continue
+
+                        dx = abs(other.pos.x - x) % width
+                        dy = abs(other.pos.y - y) % height
+                        distance = math.hypot(min(dx, width - dx), min(dy, height - dy))
+                        if distance <= limit:
+                            found.append((distance, other.id, other))
+            if len(found) > k:
+                found = heapq.nsmallest(k, found)
+            else:
+                found.sort()
+
+        return [(other, distance) for distance, _, other in found]
+
+    def in_proximity_performance(self, agent):
+        """Agents in the same cell, without a distance check."""
+        cell = self._cell(agent.pos)
+        return ProximityIter(
+            other for cells in self.indexes.values() for other in cells[cell] if other is not agent
+        )
+
+
+class VerletGrid(TorusGrid):
+    """`TorusGrid` with per-agent neighbour lists that are reused across frames.
+
+    Lists hold every agent within `radius + skin` at build time. As long as no
+    agent has moved more than `skin / 2` since then, nobody can have entered the
+    radius from outside the list, so queries only filter the cached list by exact
+    distance. `rebuilds` and `updates` count list builds and ticks, so
+    `hit_rate` is the fraction of ticks that reused the lists.
+
+    Only plain queries use the lists. Queries for a kind, a radius of their
+    own or flags scan the grid like a `TorusGrid`.
+    """
+
+    def __init__(self, agents, radius, width, height, skin=20):
+        self.skin = skin
+        self.lists = {}
+        self.anchors = {}
+        self.previous = {}
+        self.rebuilds = 0
+        self.updates = 0
+        super().__init__(agents, radius, width, height)
+
+    @property
+    def hit_rate(self):
+        return 1 - self.rebuilds / self.updates if self.updates else 0.0
+
+    def _set_radius(self, radius):
+        if radius != self.radius:
+            # Lists built for a different radius are useless
+            self.anchors = {}
+        super()._set_radius(radius)
+
+    def _displacement(self, a, b):
+        dx = abs(a[0] - b[0]) % self.width
+        dy = abs(a[1] - b[1]) % self.height
+        return math.hypot(min(dx, self.width - dx), min(dy, self.height - dy))
+
+    def _is_stale(self, agents, positions):
+        if len(agents) != len(self.anchors) or any(agent not in self.anchors for agent in agents):
+            return True
+
+        # Agents keep moving while others query during the next tick, so leave room for one more step
+        drift = max(self._displacement(positions[agent], self.anchors[agent]) for agent in agents)
+        step = max(self._displacement(positions[agent], self.previous[agent]) for agent in agents)
+        return drift + step > self.skin / 2
+
+    def update(self):
+        super().update()
+        agents = self.agents.sprites()
+        if not agents:
+            return
+
+        positions = {agent: (agent.pos.x, agent.pos.y) for agent in agents}
+        self.updates += 1
+        if self._is_stale(agents, positions):
+            plan, reaches = self._plan((object,)), (self.radius + self.skin,)
+            self.lists = {agent: [other for other, _, _ in self._scan(agent, plan, reaches)] for agent in agents}
+            self.anchors = positions
+            self.rebuilds += 1
+
+        self.previous = positions
+
+    def _accurate_retrieval(self, agent, kind, radius, flags):
+        candidates = self.lists.get(agent)
+        if candidates is None or kind is not object or flags or radius not in (None, self.radius):
+            # Spawned since the last build (the next update will rebuild), or a query the lists do not cover
+            yield from super()._accurate_retrieval(agent, kind, radius, flags)
+            return
+
+        if not agent.is_alive():
+            return
+
+        x, y = agent.pos.x, agent.pos.y
+        width, height, radius = self.width, self.height, self.radius
+        for other in candidates:
+            dx = abs(other.pos.x - x) % width
+            dy = abs(other.pos.y - y) % height
+            distance = math.hypot(min(dx, width - dx), min(dy, height - dy))
+            if distance <= radius and other.is_alive():
+                yield other, distance
+
+
+class Flag:
+    """A boolean agent attribute that a `TorusGrid` indexes: `in_castle = Flag()` in the class body of a `GridAgent`.
+
+    It reads and assigns like a plain attribute (False until set). The value
+    lives in the agent's `flags`, the names of its flags that are set.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, agent, owner=None):
+        if agent is None:
+            return self
+        return self.name in agent.flags
+
+    def __set__(self, agent, value):
+        old = agent.flags
+        flags = old | {self.name} if value else old - {self.name}
+        if flags == old:
+            return
+
+        agent.flags = flags
+        proximity = getattr(agent.shared, "proximity", None)
+        if proximity is not None:
+            proximity.reflag(agent, old)
+
+
+class GridAgent:
+    """Mixin for agents that use the extra queries of a `TorusGrid`: `class Prey(GridAgent, Agent)`.
+
+    Without a `TorusGrid` the queries still work, by going through violet's
+    own `in_proximity_accuracy`, and `flags` are checked agent by agent.
+    """
+
+    flags = NO_FLAGS  # Names of the agent's `Flag`s that are set
+
+    def kill(self):
+        """Die, and leave the grid at once, so no query in the rest of this frame finds the agent."""
+        super().kill()
+        proximity = getattr(self.shared, "proximity", None)
+        if proximity is not None:
+            proximity.remove(self)
+
+    def _violet_proximity(self, radius):
+        """Violet's query, cut down to `radius`. It cannot see past its own radius, so a larger one is an error."""
+        if radius is not None and radius > self.config.radius:
+            raise ValueError(f"radius {radius} is larger than the proximity radius {self.config.radius}, use a TorusGrid")
+        neighbours = super().in_proximity_accuracy()
+        return neighbours if radius is None else neighbours.filter(lambda pair: pair[1] <= radius)
+
+    def distance_to(self, other):
+        """Distance to another agent, around the torus on a `TorusGrid`, e.g. after moving since a query."""
+        proximity = getattr(self.shared, "proximity", None)
+        if proximity is not None:
+            return proximity.distance(self, other)
+        return self.pos.distance_to(other.pos)
+
+    def in_proximity_accuracy(self, kind=None, radius=None, flags=None):
+        """Violet's query or, with a `kind`, only the neighbours of that kind, without looking at the others.
+
+        `radius` searches a smaller or larger area than the configured radius,
+        `flags` (e.g. `{"in_castle": False}`) leaves out agents whose flags differ.
+        """
+        if kind is None and radius is None and not flags:
+            return super().in_proximity_accuracy()
+
+        proximity = getattr(self.shared, "proximity", None)
+        if proximity is not None:
+            return proximity.in_proximity_accuracy(self, kind or object, radius, flags)
+        neighbours = self._violet_proximity(radius)
+        if flags:
+            neighbours = neighbours.filter(lambda pair: _has_flags(pair[0], flags))
+        return neighbours if kind is None else neighbours.filter_kind(kind)
+
+    def nearest(self, kind=object, k=1, max_radius=None, select=None, flags=None):
+        """The `k` agents of `kind` nearest to this one, as `(agent, distance)` pairs, nearest first.
+
+        `max_radius=None` searches the whole world on a `TorusGrid`, and the
+        configured radius with violet's engine.
+        """
+        proximity = getattr(self.shared, "proximity", None)
+        if proximity is not None:
+            return proximity.nearest(self, kind, k, max_radius, select, flags)
+
+        neighbours = self._violet_proximity(max_radius).filter_kind(kind)
+        if flags:
+            neighbours = neighbours.filter(lambda pair: _has_flags(pair[0], flags))
+        if select is not None:
+            neighbours = neighbours.filter(lambda pair: select(pair[0]))
+        return heapq.nsmallest(k, neighbours, key=lambda pair: (pair[1], pair[0].id))
+
+    def in_proximity_kinds(self, *kinds, radius=None, flags=None):
+        """Neighbours split by kind from one scan, e.g. `castles, prey = self.in_proximity_kinds(Castle, Prey)`.
+
+        `radius` is one radius for all kinds, or one per kind (None for the configured radius).
+        `flags` leaves out agents of any kind whose flags differ.
+        """
+        proximity = getattr(self.shared, "proximity", None)
+        if proximity is not None:
+            return proximity.in_proximity_kinds(self, kinds, radius, flags)
+
+        if radius is None or isinstance(radius, (int, float)):
+            radius = [radius] * len(kinds)
+        reaches = [reach or self.config.radius for reach in radius]
+        groups = [[] for _ in kinds]
+        for other, distance in self._violet_proximity(max(reaches)):
+            if flags and not _has_flags(other, flags):
+                continue
+            for kind, group, reach in zip(kinds, groups, reaches):
+                if isinstance(other, kind):
+                    if distance <= reach:
+                        group.append((other, distance))
+                    break
+        return groups
+
+
+def _install(simulation, grid):
+    simulation._proximity = grid
+    simulation.shared.proximity = grid
+    return simulation
+
+
+def use_torus_grid(simulation, width=None, height=None):
+    """Swap the simulation's proximity engine for a `TorusGrid` and return the simulation.
+
+    The torus is the size of the window unless `width` and `height` say otherwise.
+    Agents reach the grid as `self.shared.proximity`, see `GridAgent`.
+    """
+    window_width, window_height = simulation.config.window.as_tuple()
+    grid = TorusGrid(simulation._agents, simulation.config.radius, width or window_width, height or window_height)
+    return _install(simulation, grid)
+
+
+def use_verlet_grid(simulation, skin=20, width=None, height=None):
+    """Swap the simulation's proximity engine for a `VerletGrid` and return the simulation.
+
+    The grid stays reachable as `simulation._proximity`, e.g. to print its `hit_rate`.
+    """
+    window_width, window_height = simulation.config.window.as_tuple()
+    grid = VerletGrid(simulation._agents, simulation.config.radius, width or window_width, height or window_height, skin)
+    return _install(simulation, grid)
+
@@ -0,0 +1,43 @@
+"""Pre-rotated sprites.
+
+With `image_rotation=True`, violet rotates every agent's sprite with
+`pygame.transform.rotate` on every frame. Agents that inherit `CachedRotation`
+(before `Agent`) instead pick the rotation of their sprite closest to their
+heading, out of `rotation_buckets` rotations that are made once per image:
+
+    class FlockingAgent(CachedRotation, Agent):
+        ...
+
+72 buckets means a sprite is at most 2.5 degrees off its exact heading.
+"""
+import pygame as pg
+from pygame.math import Vector2
+
+BUCKETS = 72
+
+_rotations = {}  # (image, buckets) -> rotated copies of the image, one per bucket
+
+
+def rotations(image, buckets=BUCKETS):
+    """All `buckets` rotations of an image, counter-clockwise from 0 degrees, made on first use."""
+    key = (image, buckets)
+    rotated = _rotations.get(key)
+    if rotated is None:
+        step = 360 / buckets
+        rotated = [pg.transform.rotate(image, bucket * step) for bucket in range(buckets)]
+        _rotations[key] = rotated
+    return rotated
+
+
+class CachedRotation:
+    rotation_buckets = BUCKETS
+
+    def _get_image(self):
+        image = self._images[self._image_index]
+        if not self.config.image_rotation:
+            return image
+
+        # Same angle as violet's own rotation, rounded to the nearest bucket
+        angle = self.move.angle_to(Vector2((0, -1)))
+        rotated = rotations(image, self.rotation_buckets)
+        return rotated[round(angle * len(rotated) / 360) % len(rotated)]
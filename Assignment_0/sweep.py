@@ -0,0 +1,127 @@
+"""Headless parameter sweep over the flocking weights.
+
+Every point of the sweep is one headless run with its own seed, measured with
+`flock_metrics`. Points run on a process pool and their summaries (the
+average order parameters over the last quarter of the run) end up in one
+table, one row per point.
+
+A grid of values:
+
+    python Assignment_0/sweep.py alignment_weight=0.2,0.5,0.8 cohesion_weight=0.2,0.5 --out sweep.csv
+
+Or a random sample of ranges:
+
+    python Assignment_0/sweep.py alignment_weight=0:1 separation_weight=0:1 mass=5:40 --samples 200 --out sweep.csv
+
+Seeds are derived from `--seed` and the index of the point, so the same
+command gives the same table, no matter how many workers run it.
+"""
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import polars as pl
+
+PARAMETERS = ("alignment_weight", "cohesion_weight", "separation_weight", "mass", "max_velocity")
+SUMMARY = ("polarization", "mean_speed", "nn_p50", "isolated", "flocks")
+
+
+def parse_parameter(text):
+    """`name=1,2,3` gives a list of values, `name=lo:hi` a range to sample from."""
+    name, _, values = text.partition("=")
+    if name not in PARAMETERS:
+        raise argparse.ArgumentTypeError(f"can only sweep {', '.join(PARAMETERS)}, not {name!r}")
+    if ":" in values:
+        low, high = values.split(":")
+        return name, (float(low), float(high))
+    return name, [float(value) for value in values.split(",")]
+
+
+def sweep_points(parameters, samples=None, seed=0):
+    """List the points of the sweep: the full grid, or `samples` random points within the ranges."""
+    names = [name for name, _ in parameters]
+    if samples is None:
+        if any(isinstance(values, tuple) for _, values in parameters):
+            raise ValueError("ranges (lo:hi) need --samples")
+        return [dict(zip(names, combination)) for combination in itertools.product(*(v for _, v in parameters))]
+
+    rng = np.random.default_rng(seed)
+    points = []
+    for _ in range(samples):
+        point = {}
+        for name, values in parameters:
+            if isinstance(values, tuple):
+                point[name] = float(rng.uniform(*values))
+            else:
+                point[name] = float(rng.choice(values))
+        points.append(point)
+    return points
+
+
+def run_point(point, seed, frames=3000, agents=100, scene="Assignment_0/scenes/triangle.json", every=10):
+    """Run one headless flocking simulation and summarise its order parameters."""
+    # Imported here, so the pool workers only load violet once they run a point
+    from vi import HeadlessSimulation
+    from flocking import FlockingAgent, FlockingConfig
+    from flock_metrics import use_flock_metrics
+    from obstacles import load_scene
+    from spatial_grid import use_torus_grid
+
+    values = dict(point)
+    if "mass" in values:
+        values["mass"] = int(round(values["mass"]))
+
+    config = FlockingConfig(movement_speed=2.0, radius=80, duration=frames, seed=seed, **values)
+    FlockingAgent.obstacles = load_scene(scene, margin=config.radius) if scene else None
+
+    sim = use_flock_metrics(use_torus_grid(HeadlessSimulation(config)), every=every)
+    sim.batch_spawn_agents(agents, FlockingAgent, images=["Assignment_0/images/triangle.png"]).run()
+
+    metrics = sim.flock_metrics.to_frame()
+    tail = metrics.tail(max(1, len(metrics) // 4))
+    summary = {name: tail[name].mean() for name in SUMMARY}
+    return {**values, "seed": seed, **summary}
+
+
+def run_sweep(points, seed=0, workers=None, **run_options):
+    """Run every point on a process pool and collect the summaries in one DataFrame."""
+    seeds = [seed * 1_000_003 + index for index in range(len(points))]
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(run_point, point, point_seed, **run_options) for point, point_seed in zip(points, seeds)]
+        rows = [future.result() for future in futures]
+    return pl.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("parameters", nargs="+", type=parse_parameter, help="name=v1,v2,... or name=lo:hi")
+    parser.add_argument("--samples", type=int, help="random points instead of the full grid")
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--agents", type=int, default=100)
+    parser.add_argument("--scene", default="Assignment_0/scenes/triangle.json", help="'' for no obstacles")
+    parser.add_argument("--every", type=int, default=10, help="record the order parameters every N frames")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--out", default="Assignment_0/sweep.csv")
+    args = parser.parse_args()
+
+    points = sweep_points(args.parameters, args.samples, args.seed)
+    print(f"Running {len(points)} points on {args.workers} workers")
+    table = run_sweep(
+        points,
+        seed=args.seed,
+        workers=args.workers,
+        frames=args.frames,
+        agents=args.agents,
+        scene=args.scene,
+        every=args.every,
+    )
+    table.write_csv(args.out)
+    print(table)
+    print(f"Saved sweep to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,23 @@
 from dataclasses import dataclass
-from vi import Agent, Config, Simulation, HeadlessSimulation
+from vi import Agent, Simulation, HeadlessSimulation
 from pygame.math import Vector2
 import random
-import math
-import pygame
-import polars as pl
 import seaborn as sns
 import matplotlib.pyplot as plt
 import datetime
+from spatial_grid import use_torus_grid
+from overlay import draw_zones, use_static_overlay
+from sprite_cache import CachedRotation
+from probabilities import ProbabilityConfig
+from sinks import FrameCounts, use_snapshot_sink
+from convergence import use_steady_state
 
 
 # ------------------------------
 # CONFIGURATION
 # ------------------------------
 @dataclass
-class AggregationConfig(Config):
+class AggregationConfig(ProbabilityConfig):
     speed: float = 0.5
     radius: float = 10.0
     aggregation_zone_radius: float = 120.0
@@ -32,7 +35,7 @@ class AggregationZone:
 # ------------------------------
 # AGENT DEFINITION
 # ------------------------------
-class AggregationAgent(Agent):
+class AggregationAgent(CachedRotation, Agent):
     WANDERING, JOIN, STILL, LEAVE = range(4)
     zones = []
 
@@ -46,15 +49,6 @@ class AggregationAgent(Agent):
         self.state_timer = 0
         self.move = Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize() * self.config.speed
 
-    def update(self):
-        # Draw aggregation zone (called every frame)
-        screen = pygame.display.get_surface()
-        if screen:
-            for zone in AggregationAgent.zones:
-                pos = zone.pos
-                radius = zone.radius
-                pygame.draw.circle(screen, (255, 255, 0), (int(pos.x), int(pos.y)), int(radius), width=2)
-
     def change_position(self):
         neighbors = self.in_proximity_accuracy()
         in_zone = False
@@ -66,9 +60,9 @@ class AggregationAgent(Agent):
                 n += sum(1 for agent, _ in neighbors if (agent.pos - zone.pos).length() < zone.radius)
 
         # Probability formulas
-        a, b = 1.70188, 3.88785
-        PJoin = 0.03 + 0.48 * (1 - math.exp(-a * n)) if in_zone else 0
-        PLeave = math.exp(-b * n) if in_zone else 1
+        join, leave = self.config.tables
+        PJoin = join[n] if in_zone else 0
+        PLeave = leave[n] if in_zone else 1
 
         # Determine which zone (if any) the agent is in
         in_first_zone = (self.pos - self.zones[0].pos).length() < self.zones[0].radius
@@ -132,35 +126,40 @@ AggregationAgent.zones = [
     AggregationZone(Vector2(525, 400), similar_radiusses[1])
 ]
 
+stop_when_steady = False  # Stop a run as soon as the zones are steady, instead of after `duration` frames
+
 for run in range(1, 3): # Change range for more runs
-    df = (
-        HeadlessSimulation(
-            AggregationConfig(
-                image_rotation=True,
-                speed=10,
-                radius=10,
-                fps_limit=0,
-                duration=1000 * 60, # Length of simulation
-            )
+    counts = FrameCounts("image_index", window=500)  # Adjust window size for smoothing
+    simulation = (
+        use_snapshot_sink(
+            use_static_overlay(
+                use_torus_grid(
+                    HeadlessSimulation(
+                        AggregationConfig(
+                            image_rotation=True,
+                            speed=10,
+                            radius=10,
+                            curves="",  # JSON file with other join/leave curves, see probabilities.py
+                            fps_limit=0,
+                            duration=1000 * 60, # Length of simulation
+                        )
+                    )
+                ),
+                draw_zones(AggregationAgent.zones),
+            ),
+            counts,
         )
         .batch_spawn_agents(
             100,
             AggregationAgent,
             images=["Assignment_1/images/triangle.png", "Assignment_1/images/triangle_zone.png", "Assignment_1/images/triangle_zone.png"]
         )
-        .run()
-        .snapshots
-        .group_by(["frame", "image_index"])
-        .agg(pl.count("id").alias("agents"))
-    )
-    window_size = 500 # Adjust window size for smoothing
-    df = df.sort(["image_index", "frame"])
-    df = df.with_columns(
-        pl.col("agents")
-        .rolling_mean(window_size, min_periods=1)
-        .over("image_index")
-        .alias("agents_smoothed")
     )
+    # Agents per zone, to tell when the run is steady (see convergence.py)
+    use_steady_state(simulation, lambda _: [counts.latest[1], counts.latest[2]], stop=stop_when_steady)
+    simulation.run()
+    df = counts.to_frame()
+    print(f"Steady from frame {simulation.steady_state.converged_at}")
 
     # Generate unique filenames using timestamp and run number
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
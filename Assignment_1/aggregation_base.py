@@ -1,11 +1,13 @@
 from dataclasses import dataclass
-from vi import Agent, Config, Simulation
+from vi import Agent, Simulation
 from pygame.math import Vector2
 import random
-import math
+from spatial_grid import use_torus_grid
+from sprite_cache import CachedRotation
+from probabilities import ProbabilityConfig
 
 @dataclass
-class AggregationConfig(Config):
+class AggregationConfig(ProbabilityConfig):
     speed: float = 0.5
     radius: float = 10.0
     aggregation_zone_radius: float = 120.0
@@ -17,7 +19,7 @@ class AggregationZone:
         self.pos = pos
         self.radius = radius
 
-class AggregationAgent(Agent):
+class AggregationAgent(CachedRotation, Agent):
     WANDERING, JOIN, STILL, LEAVE = range(4)
     zone = None
 
@@ -42,9 +44,9 @@ class AggregationAgent(Agent):
             n = sum(1 for _, dist in neighbors if dist < self.config.aggregation_zone_radius)
             in_zone = n > 0
 
-        a, b = 1.70188, 3.88785
-        PJoin = 0.03 + 0.48 * (1 - math.exp(-a * n)) if in_zone else 0
-        PLeave = math.exp(-b * n) if in_zone else 1
+        join, leave = self.config.tables
+        PJoin = join[n] if in_zone else 0
+        PLeave = leave[n] if in_zone else 1
 
         if self.state == self.WANDERING:
             if random.random() < 0.02:
@@ -87,12 +89,15 @@ class AggregationAgent(Agent):
 # To use a zone, uncomment below:
 # AggregationAgent.zone = AggregationZone(Vector2(500, 500), 120)
 
-sim = Simulation(
-    AggregationConfig(
-        image_rotation=True,
-        speed=1,
-        radius=10,
-        fps_limit=0,
+sim = use_torus_grid(
+    Simulation(
+        AggregationConfig(
+            image_rotation=True,
+            speed=1,
+            radius=10,
+            curves="",  # JSON file with other join/leave curves, see probabilities.py
+            fps_limit=0,
+        )
     )
 )
 
@@ -1,20 +1,27 @@
 from dataclasses import dataclass
-from vi import Agent, Config, Simulation
+from vi import Agent, Simulation
 from pygame.math import Vector2
-import random, math, datetime
+import random, datetime
+from collections import ChainMap
 import polars as pl
 import seaborn as sns
 import matplotlib.pyplot as plt
+from spatial_grid import use_torus_grid
+from sprite_cache import CachedRotation
+from probabilities import ProbabilityConfig
+from sinks import FrameCounts, use_snapshot_sink
+from rolling import use_rolling_display
+from clusters import use_cluster_tracker
 
 @dataclass
-class AggregationConfig(Config):
+class AggregationConfig(ProbabilityConfig):
     speed: float = 0.5
     radius: float = 10.0
     aggregation_zone_radius: float = 120.0
     Tjoin: int = 30
     Tleave: int = 30
 
-class AggregationAgent(Agent):
+class AggregationAgent(CachedRotation, Agent):
     WANDERING, JOIN, STILL, LEAVE = range(4)
     zone = None
 
@@ -33,9 +40,9 @@ class AggregationAgent(Agent):
         n = sum(1 for _, dist in neighbors if dist < self.config.aggregation_zone_radius)
         in_zone = n > 0
 
-        a, b = 1.70188, 3.88785
-        PJoin = 0.03 + 0.48 * (1 - math.exp(-a * n)) if in_zone else 0
-        PLeave = math.exp(-b * n) if in_zone else 1
+        join, leave = self.config.tables
+        PJoin = join[n] if in_zone else 0
+        PLeave = leave[n] if in_zone else 1
 
         if self.state == self.WANDERING:
             if random.random() < 0.02:
@@ -77,40 +84,42 @@ class AggregationAgent(Agent):
         self.pos.x %= 1000
         self.pos.y %= 1000
 
-# Run the simulation and access snapshots
-sim = (
-    Simulation(
-        AggregationConfig(
-            image_rotation=True,
-            speed=1,
-            radius=10,
-            fps_limit=0,
-            duration=1000 * 60,
-        )
+# Map state indices to names for plotting
+state_names = {0: "WANDERING", 1: "JOIN", 2: "STILL", 3: "LEAVE"}
+
+# Agent states per frame, counted and smoothed while the simulation runs
+counts = FrameCounts("state", window=300)
+# Clusters of STILL agents (the aggregates) per frame
+simulation = use_cluster_tracker(
+    use_snapshot_sink(
+        use_torus_grid(
+            Simulation(
+                AggregationConfig(
+                    image_rotation=True,
+                    speed=1,
+                    radius=10,
+                    curves="",  # JSON file with other join/leave curves, see probabilities.py
+                    fps_limit=0,
+                    duration=1000 * 60,
+                )
+            )
+        ),
+        counts,
+    ),
+    lambda agent: agent.state == AggregationAgent.STILL,
+)
+clusters = simulation.clusters
+(
+    use_rolling_display(
+        simulation,
+        ChainMap(clusters.rolling, counts.rolling),
+        labels={**state_names, "clusters": "STILL clusters", "largest": "Largest cluster"},
     )
     .batch_spawn_agents(100, AggregationAgent, images=["Assignment_1/images/triangle.png"])
     .run()
 )
-
-# Get agent states per frame from snapshots
-df = (
-    sim.snapshots
-    .group_by(["frame", "state"])
-    .agg(pl.count("id").alias("agents"))
-)
-
-# Optional: smoothing
-window_size = 300
-df = df.sort(["state", "frame"])
-df = df.with_columns(
-    pl.col("agents")
-    .rolling_mean(window_size, min_periods=1)
-    .over("state")
-    .alias("agents_smoothed")
-)
-
-# Map state indices to names for plotting
-state_names = {0: "WANDERING", 1: "JOIN", 2: "STILL", 3: "LEAVE"}
+df = counts.to_frame()
+cluster_df = clusters.to_frame()
 df = df.with_columns(
     pl.col("state").map_elements(lambda s: state_names.get(s, str(s))).alias("state_name")
 )
@@ -119,8 +128,12 @@ df = df.with_columns(
 timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 plot_filename = f"Assignment_1/results_stage2/bonus{timestamp}.png"
 data_filename = f"Assignment_1/results_stage2/State_data_{timestamp}.csv"
+cluster_filename = f"Assignment_1/results_stage2/Cluster_data_{timestamp}.csv"
+histogram_filename = f"Assignment_1/results_stage2/Cluster_sizes_{timestamp}.csv"
 
 df.write_csv(data_filename)
+cluster_df.write_csv(cluster_filename)
+clusters.histogram_frame().write_csv(histogram_filename)
 
 # Plot
 sns.set(style="darkgrid")
@@ -129,3 +142,5 @@ plot.set_titles("Agent States Over Time")
 plot.savefig(plot_filename, dpi=300)
 
 print(f"Saved plot to {plot_filename} and data to {data_filename}")
+print(cluster_df.tail(1))
+print(f"Saved clusters to {cluster_filename} and their sizes to {histogram_filename}")
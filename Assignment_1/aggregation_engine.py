@@ -0,0 +1,226 @@
+"""Batched aggregation engine.
+
+`BatchedAggregation` runs the WANDERING/JOIN/STILL/LEAVE model of the
+aggregation scripts for all agents at once. Positions, velocities, states and
+timers live in NumPy arrays, the Bernoulli trials of a frame are drawn in one
+go and the transitions are applied with masks. It does not go through violet
+at all, which is what long headless experiments (60,000 frames, hundreds of
+replicates) need.
+
+It follows `AggregationAgent.change_position` of the scripts, with two
+differences: all agents move synchronously (like `double_buffer`), and the
+random numbers come from a NumPy generator, so runs match the scripts
+statistically rather than draw for draw.
+
+Run replicates of the stage 1 or stage 2 experiment directly:
+
+    python Assignment_1/aggregation_engine.py --stage 2 --replicates 100
+
+With `--window 5000`, a replicate stops as soon as the number of agents per
+zone is steady (see convergence.py), and the `converged_at` column records the
+frame where it did.
+"""
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+import polars as pl
+from pygame.math import Vector2
+
+from clusters import neighbour_pairs
+from convergence import SteadyState
+from probabilities import ProbabilityConfig
+from zones import zone_membership
+
+WIDTH, HEIGHT = 1000, 1000
+WANDERING, JOIN, STILL, LEAVE = range(4)
+DENSE_LIMIT = 1000  # Up to this many agents, neighbours are counted with an all-pairs distance matrix
+
+
+@dataclass
+class AggregationConfig(ProbabilityConfig):
+    speed: float = 0.5
+    radius: float = 10.0
+    aggregation_zone_radius: float = 120.0
+    Tjoin: int = 30
+    Tleave: int = 30
+
+
+class AggregationZone:
+    def __init__(self, pos: Vector2, radius: float):
+        self.pos = pos
+        self.radius = radius
+
+
+def _normalized(vectors, length):
+    norm = np.hypot(vectors[:, 0], vectors[:, 1])[:, None]
+    return np.divide(vectors * length, norm, out=np.zeros_like(vectors), where=norm > 0)
+
+
+class BatchedAggregation:
+    def __init__(self, config, zones, count, seed=None, images=3, spawn_area=(750, 750)):
+        self.config = config
+        self.zones = zones
+        self.images = images
+        self.rng = np.random.default_rng(seed)
+
+        # Like violet: spawned inside the window, moving at `movement_speed` until the first turn
+        self.pos = self.rng.uniform((0, 0), spawn_area, size=(count, 2))
+        angles = self.rng.uniform(0, 2 * np.pi, size=count)
+        self.move = np.column_stack((np.cos(angles), np.sin(angles))) * config.movement_speed
+        self.state = np.full(count, WANDERING)
+        self.state_timer = np.zeros(count, dtype=int)
+
+    def __len__(self):
+        return len(self.pos)
+
+    def neighbour_counts(self, pos, zone):
+        """Per position, the number of other positions within `radius` (on the torus) that are in the same zone."""
+        n = len(pos)
+        radius = self.config.radius
+        if n <= DENSE_LIMIT:
+            # Small populations: all pairs at once is cheaper than setting up the grid
+            offset = pos[None, :, :] - pos[:, None, :]
+            offset -= (WIDTH, HEIGHT) * np.round(offset / (WIDTH, HEIGHT))
+            near = ((offset ** 2).sum(axis=2) <= radius ** 2) & (zone[None, :] == zone[:, None])
+            return near.sum(axis=1) - 1
+
+        # Each pair within `radius` turns up once, and counts for both of its agents
+        i, j = neighbour_pairs(pos, radius, WIDTH, HEIGHT)
+        same = zone[i] == zone[j]
+        return np.bincount(i[same], minlength=n) + np.bincount(j[same], minlength=n)
+
+    def step(self):
+        """Advance every agent by one frame and return the zone each agent was in at the start of it."""
+        config = self.config
+        count = len(self.pos)
+        state, state_timer, move, pos = self.state, self.state_timer, self.move, self.pos
+
+        zone = zone_membership(pos, self.zones)
+        in_zone = zone >= 0
+        # Only agents inside a zone have neighbours that count
+        n = np.zeros(count, dtype=int)
+        if in_zone.any():
+            n[in_zone] = self.neighbour_counts(pos[in_zone], zone[in_zone])
+
+        # Probability formulas, gathered from the lookup tables
+        join, leave = config.tables
+        PJoin = np.where(in_zone, join.gather(n), 0)
+        PLeave = np.where(in_zone, leave.gather(n), 1)
+        turn_draw, join_draw, leave_draw = self.rng.random((3, count))
+
+        wandering = state == WANDERING
+        joining = state == JOIN
+        still = state == STILL
+        leaving = state == LEAVE
+
+        # WANDERING: now and then turn up to 45 degrees (at full speed), maybe join
+        turn = wandering & (turn_draw < 0.02)
+        if turn.any():
+            angles = np.radians(self.rng.uniform(-45, 45, size=turn.sum()))
+            cos, sin = np.cos(angles), np.sin(angles)
+            turned = np.column_stack((
+                move[turn, 0] * cos - move[turn, 1] * sin,
+                move[turn, 0] * sin + move[turn, 1] * cos,
+            ))
+            turned[(turned == 0).all(axis=1)] = (1, 0)
+            move[turn] = _normalized(turned, config.speed)
+        join = wandering & in_zone & (join_draw < PJoin)
+
+        # JOIN: slow down and settle after Tjoin frames
+        state_timer[joining] += 1
+        settle = joining & (state_timer > config.Tjoin)
+
+        # STILL: stand still, maybe leave after Tleave frames
+        move[still] = 0
+        state_timer[still] += 1
+        leave = still & (state_timer > config.Tleave) & (leave_draw < PLeave)
+
+        # LEAVE: get going again in a random direction and wander after 10 frames
+        stalled = leaving & (np.hypot(move[:, 0], move[:, 1]) < 0.01)
+        if stalled.any():
+            angles = self.rng.uniform(0, 2 * np.pi, size=stalled.sum())
+            move[stalled] = np.column_stack((np.cos(angles), np.sin(angles))) * config.speed
+        state_timer[leaving] += 1
+        done = leaving & (state_timer > 10)
+
+        walking = wandering | leaving
+        pos[walking] += move[walking]
+        pos[joining] += _normalized(move[joining], config.speed * 0.2)
+        pos %= (WIDTH, HEIGHT)
+
+        for mask, new_state in ((join, JOIN), (settle, STILL), (leave, LEAVE), (done, WANDERING)):
+            state[mask] = new_state
+            state_timer[mask] = 0
+
+        return zone
+
+    def run(self, frames, steady=None):
+        """Run `frames` frames and return the number of agents per image index (0 outside the zones) per frame.
+
+        With a `convergence.SteadyState`, the run stops early once the number of agents per zone converged.
+        """
+        counts = np.zeros((frames, self.images), dtype=int)
+        for frame in range(frames):
+            zone = self.step()
+            image_index = np.minimum(zone + 1, self.images - 1)
+            counts[frame] = np.bincount(image_index, minlength=self.images)
+            if steady is not None and steady.push(frame, counts[frame, 1:]):
+                return counts[:frame + 1]
+        return counts
+
+
+def counts_frame(counts):
+    """Long `frame, image_index, agents` table, like grouping violet's snapshots by frame and image index."""
+    frames, images = counts.shape
+    table = pl.DataFrame({
+        "frame": np.repeat(np.arange(frames), images),
+        "image_index": np.tile(np.arange(images), frames),
+        "agents": counts.ravel(),
+    })
+    # Snapshots only have rows for image indices that some agent has
+    return table.filter(pl.col("agents") > 0)
+
+
+STAGES = {
+    1: ([AggregationZone(Vector2(500, 500), 120)], 2),
+    2: ([AggregationZone(Vector2(225, 400), 80), AggregationZone(Vector2(525, 400), 80)], 3),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replicates of the aggregation experiments")
+    parser.add_argument("--stage", type=int, choices=sorted(STAGES), default=1)
+    parser.add_argument("--replicates", type=int, default=10)
+    parser.add_argument("--frames", type=int, default=1000 * 60)
+    parser.add_argument("--agents", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--curves", default="", help="JSON file with other join/leave curves, see probabilities.py")
+    parser.add_argument("--window", type=int, help="Stop a replicate once the zones are steady over windows of this many frames")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="Agents the windows may differ by, with --window")
+    parser.add_argument("--min-frames", type=int, default=0, help="Frames to run at least, with --window")
+    parser.add_argument("--out", help="CSV file, defaults to Assignment_1/results_stage<stage>/batched_replicates.csv")
+    args = parser.parse_args()
+
+    zones, images = STAGES[args.stage]
+    config = AggregationConfig(speed=10, radius=10, curves=args.curves)
+    tables = []
+    for replicate in range(args.replicates):
+        steady = SteadyState(args.window, args.tolerance, min_frames=args.min_frames) if args.window else None
+        counts = BatchedAggregation(config, zones, args.agents, seed=args.seed + replicate, images=images).run(args.frames, steady)
+        converged_at = steady.converged_at if steady else None
+        tables.append(counts_frame(counts).with_columns(
+            pl.lit(replicate).alias("replicate"),
+            pl.lit(converged_at, dtype=pl.Int64).alias("converged_at"),
+        ))
+        print(f"Replicate {replicate + 1} of {args.replicates} done" + (
+            f", steady at frame {converged_at}" if converged_at is not None else ""
+        ))
+
+    out = args.out or f"Assignment_1/results_stage{args.stage}/batched_replicates.csv"
+    pl.concat(tables).write_csv(out)
+    print(f"Saved {args.replicates} replicates to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,17 @@
 from dataclasses import dataclass
-from vi import Agent, Config, Simulation
+from vi import Agent, Simulation
 from pygame.math import Vector2
 import random
-import math
-import pygame
+from spatial_grid import use_torus_grid
+from overlay import draw_zones, use_static_overlay
+from sprite_cache import CachedRotation
+from probabilities import ProbabilityConfig
 
 # ------------------------------
 # CONFIGURATION
 # ------------------------------
 @dataclass
-class AggregationConfig(Config):
+class AggregationConfig(ProbabilityConfig):
     speed: float = 0.5
     radius: float = 10.0
     aggregation_zone_radius: float = 120.0
@@ -27,7 +29,7 @@ class AggregationZone:
 # ------------------------------
 # AGENT DEFINITION
 # ------------------------------
-class AggregationAgent(Agent):
+class AggregationAgent(CachedRotation, Agent):
     WANDERING, JOIN, STILL, LEAVE = range(4)
     zone = None
 
@@ -41,14 +43,6 @@ class AggregationAgent(Agent):
         self.state_timer = 0
         self.move = Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize() * self.config.speed
 
-    def update(self):
-        # Draw aggregation zone (called every frame)
-        screen = pygame.display.get_surface()
-        if AggregationAgent.zone:
-            pos = AggregationAgent.zone.pos
-            radius = AggregationAgent.zone.radius
-            pygame.draw.circle(screen, (255, 255, 0), (int(pos.x), int(pos.y)), int(radius), width=2)
-
     def change_position(self):
         zone = self.zone
         neighbors = self.in_proximity_accuracy()
@@ -61,9 +55,9 @@ class AggregationAgent(Agent):
             in_zone = n > 0
 
         # Probability formulas
-        a, b = 1.70188, 3.88785
-        PJoin = 0.03 + 0.48 * (1 - math.exp(-a * n)) if in_zone else 0
-        PLeave = math.exp(-b * n) if in_zone else 1
+        join, leave = self.config.tables
+        PJoin = join[n] if in_zone else 0
+        PLeave = leave[n] if in_zone else 1
 
         # State transitions
         if self.state == self.WANDERING:
@@ -109,14 +103,18 @@ class AggregationAgent(Agent):
 # ------------------------------
 AggregationAgent.zone = AggregationZone(Vector2(500, 500), 120)
 
-sim = Simulation(
-    AggregationConfig(
-        image_rotation=True,
-        speed=0.2,
-        radius=10,
-        fps_limit=0,
+sim = use_torus_grid(
+    Simulation(
+        AggregationConfig(
+            image_rotation=True,
+            speed=0.2,
+            radius=10,
+            curves="",  # JSON file with other join/leave curves, see probabilities.py
+            fps_limit=0,
+        )
     )
 )
+use_static_overlay(sim, draw_zones([AggregationAgent.zone]))
 
 sim.batch_spawn_agents(
     100,
@@ -1,16 +1,24 @@
 from dataclasses import dataclass
-from vi import Agent, Config, Simulation
+from vi import Agent, Simulation
 from pygame.math import Vector2
 import random
 import math
 import pygame
 import matplotlib.pyplot as plt
+from spatial_grid import use_torus_grid
+from overlay import draw_zones, use_static_overlay
+from zones import zone_counts, zone_membership
+from sprite_cache import CachedRotation
+from double_buffer import apply_state
+from dormancy import use_dormancy
+from probabilities import ProbabilityConfig
+from rolling import RollingMonitor, use_rolling_display
 
 # ------------------------------
 # CONFIGURATION
 # ------------------------------
 @dataclass
-class AggregationConfig(Config):
+class AggregationConfig(ProbabilityConfig):
     speed: float = 0.5
     radius: float = 10.0
     aggregation_zone_radius: float = 120.0
@@ -35,9 +43,12 @@ class AggregationZone:
 # ------------------------------
 # AGENT DEFINITION
 # ------------------------------
-class AggregationAgent(Agent):
+class AggregationAgent(CachedRotation, Agent):
     WANDERING, JOIN, STILL, LEAVE = range(4)
     zones = []
+    zone_index = -1  # Zone this agent is in, set once per frame by AggregationSimulation
+    double_buffered = False  # Set by double_buffer.use_double_buffer
+    leave_timer = None  # State timer at which a dormant STILL agent leaves, drawn when it fell asleep
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -49,73 +60,89 @@ class AggregationAgent(Agent):
         self.state_timer = 0
         self.move = Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize() * self.config.speed
 
-    def update(self):
-        screen = pygame.display.get_surface()
-        for zone in AggregationAgent.zones:
-            pygame.draw.circle(screen, (255, 255, 0), (int(zone.pos.x), int(zone.pos.y)), int(zone.radius), width=2)
-
     def change_position(self):
+        # With a double buffer, the simulation applies `next_state` to all agents at once
+        if not self.double_buffered:
+            apply_state(self, self.next_state())
+
+    def next_state(self):
+        """Position, velocity and state for the next frame. Only the image of this agent is changed."""
         neighbors = self.in_proximity_accuracy()
-        in_zone = False
+        zone = self.zone_index
+        in_zone = zone >= 0
         n = 0
 
-        for zone in self.zones:
-            if (self.pos - zone.pos).length() < zone.radius:
-                in_zone = True
-                n += sum(1 for agent, _ in neighbors if (agent.pos - zone.pos).length() < zone.radius)
-
-        # Probability formulas
-        a, b = 1.70188, 3.88785
-        PJoin = 0.03 + 0.48 * (1 - math.exp(-a * n)) if in_zone else 0
-        PLeave = math.exp(-b * n) if in_zone else 1
-        # Determine which zone (if any) the agent is in
-        in_first_zone = (self.pos - self.zones[0].pos).length() < self.zones[0].radius
-        in_second_zone = (self.pos - self.zones[1].pos).length() < self.zones[1].radius
-
-        if in_first_zone:
-            self.change_image(1)
-        elif in_second_zone:
-            self.change_image(2)
-        else:
-            self.change_image(0)
-
-        if self.state == self.WANDERING:
+        # Neighbours in the same zone, using the zones computed for this frame
+        if in_zone:
+            n = sum(1 for agent, _ in neighbors if agent.zone_index == zone)
+
+        # Probability formulas, looked up
+        join, leave = self.config.tables
+        PJoin = join[n] if in_zone else 0
+        PLeave = leave[n] if in_zone else 1
+
+        # Image 0 outside the zones, 1 in the first zone, 2 in any other zone
+        self.change_image(min(zone + 1, 2))
+
+        pos, move = Vector2(self.pos), Vector2(self.move)
+        state, state_timer = self.state, self.state_timer
+
+        if state == self.WANDERING:
             if random.random() < 0.02:
                 angle = random.uniform(-45, 45)
-                self.move = self.move.rotate(angle)
-                if self.move.length() == 0:
-                    self.move = Vector2(1, 0)
-                self.move = self.move.normalize() * self.config.speed
+                move = move.rotate(angle)
+                if move.length() == 0:
+                    move = Vector2(1, 0)
+                move = move.normalize() * self.config.speed
             if in_zone and random.random() < PJoin:
-                self.state, self.state_timer = self.JOIN, 0
-            self.pos += self.move
-
-        elif self.state == self.JOIN:
-            self.state_timer += 1
-            if self.state_timer > self.config.Tjoin:
-                self.state, self.state_timer = self.STILL, 0
-            self.pos += self.move.normalize() * self.config.speed * 0.2
-
-        elif self.state == self.STILL:
-            self.move = Vector2(0, 0)
-            self.state_timer += 1
-            if self.state_timer > self.config.Tleave and random.random() < PLeave:
-                self.state, self.state_timer = self.LEAVE, 0
-
-        elif self.state == self.LEAVE:
-            if self.move.length() < 0.01:
+                state, state_timer = self.JOIN, 0
+            pos += move
+
+        elif state == self.JOIN:
+            state_timer += 1
+            if state_timer > self.config.Tjoin:
+                state, state_timer = self.STILL, 0
+            pos += move.normalize() * self.config.speed * 0.2
+
+        elif state == self.STILL:
+            move = Vector2(0, 0)
+            state_timer += 1
+            if self.leave_timer is not None:
+                leave = state_timer >= self.leave_timer
+            else:
+                leave = state_timer > self.config.Tleave and random.random() < PLeave
+            if leave:
+                state, state_timer = self.LEAVE, 0
+
+        elif state == self.LEAVE:
+            if move.length() < 0.01:
                 angle = random.uniform(0, 360)
-                self.move = Vector2(1, 0).rotate(angle).normalize() * self.config.speed
-            self.state_timer += 1
-            if self.state_timer > 10:
-                self.state, self.state_timer = self.WANDERING, 0
-            self.pos += self.move
-
-        self._wrap_position()
-
-    def _wrap_position(self):
-        self.pos.x %= 1000
-        self.pos.y %= 1000
+                move = Vector2(1, 0).rotate(angle).normalize() * self.config.speed
+            state_timer += 1
+            if state_timer > 10:
+                state, state_timer = self.WANDERING, 0
+            pos += move
+
+        return {
+            "pos": self._wrap(pos),
+            "move": move,
+            "state": state,
+            "state_timer": state_timer,
+            "leave_timer": self.leave_timer if state == self.STILL else None,
+        }
+
+    def on_wake(self, frames):
+        """Called by the dormancy scheduler: catch up on the frames spent asleep."""
+        self.state_timer += frames
+        if self.leave_timer is not None and self.state_timer + 1 < self.leave_timer:
+            # Woken early because a neighbour moved, so its leaving has to be drawn again
+            self.leave_timer = None
+
+    @staticmethod
+    def _wrap(pos):
+        pos.x %= 1000
+        pos.y %= 1000
+        return pos
 
 # ------------------------------
 # CUSTOM SIMULATION
@@ -123,9 +150,65 @@ class AggregationAgent(Agent):
 class AggregationSimulation(Simulation):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        use_torus_grid(self)  # or use_verlet_grid(self, skin=...) to reuse neighbour lists
+        use_static_overlay(self, draw_zones(AggregationAgent.zones))
+        use_dormancy(self)  # STILL agents sleep while nothing around them changes, see `rest`
+        # double_buffer.use_double_buffer(self) would move all agents synchronously instead of one by one
         self.tick_count = 0
         self.max_ticks = 1000
         self.running = True
+        self.zone_index = None
+        # Live rolling means of the inside/outside counts, drawn in the corner of the window
+        self.rolling = RollingMonitor(window=500)
+        use_rolling_display(self, self.rolling.stats)
+
+    def update_zone_index(self):
+        """One membership pass over all agents: store it on every agent and return it as an array."""
+        agents = self._agents.sprites() + list(self.dormancy.sleeping)
+        index = zone_membership([(agent.pos.x, agent.pos.y) for agent in agents], AggregationAgent.zones)
+        for agent, zone in zip(agents, index.tolist()):
+            agent.zone_index = zone
+        return index
+
+    def rest(self):
+        """Put STILL agents to sleep for as long as their next frames are known, and wake those next to moving agents.
+
+        Before `Tleave` a STILL agent cannot leave. After that, it leaves with
+        the same probability every frame for as long as its neighbour count
+        stays the same, so the frame it leaves at is drawn at once (a geometric
+        distribution) and it sleeps until then. Only moving agents change the
+        count, so they wake the sleepers around them, and an agent with moving
+        neighbours stays awake.
+        """
+        Tleave = self.config.Tleave
+        for agent in self._agents.sprites():
+            zone = agent.zone_index
+            if agent.state != agent.STILL:
+                if zone >= 0:
+                    for other, _ in agent.in_proximity_accuracy():
+                        self.dormancy.wake(other)
+                continue
+
+            if agent.state_timer < Tleave:
+                self.dormancy.sleep(agent, Tleave - agent.state_timer)
+                continue
+
+            neighbours = [other for other, _ in agent.in_proximity_accuracy() if zone >= 0 and other.zone_index == zone]
+            if any(other.state != other.STILL for other in neighbours):
+                agent.leave_timer = None
+                continue
+
+            _, leave = self.config.tables
+            PLeave = leave[len(neighbours)] if zone >= 0 else 1
+            if PLeave <= 0:
+                agent.leave_timer = None
+                self.dormancy.sleep(agent)
+                continue
+
+            # Frames that it stays before the one it leaves in
+            stay = 0 if PLeave >= 1 else int(math.log(1 - random.random()) / math.log1p(-PLeave))
+            agent.leave_timer = agent.state_timer + stay + 1
+            self.dormancy.sleep(agent, stay)
 
     def run(self):
         while self.running:
@@ -137,23 +220,24 @@ class AggregationSimulation(Simulation):
             self.running = False
             return
 
+        # Agents read the zones of the current positions, which the previous tick left behind
+        if self.zone_index is None:
+            self.zone_index = self.update_zone_index()
+
         super().tick()
+        self.zone_index = self.update_zone_index()
+        self.rest()
 
         # Per-zone agent count
-        zone_counts = [0 for _ in AggregationAgent.zones]
-        for agent in self._agents:
-            for i, zone in enumerate(AggregationAgent.zones):
-                if (agent.pos - zone.pos).length() < zone.radius:
-                    zone_counts[i] += 1
-                    break
-
-        zone_agent_counts.append(zone_counts)
+        counts = zone_counts(self.zone_index, len(AggregationAgent.zones)).tolist()
+        zone_agent_counts.append(counts)
 
         # Global inside/outside tracking
-        inside_count = sum(zone_counts)
-        outside_count = len(self._agents) - inside_count
+        inside_count = sum(counts)
+        outside_count = len(self.zone_index) - inside_count
         agent_counts_inside.append(inside_count)
         agent_counts_outside.append(outside_count)
+        self.rolling.push(self.tick_count, inside=inside_count, outside=outside_count)
 
         self.tick_count += 1
 
@@ -174,6 +258,7 @@ sim = AggregationSimulation(
         image_rotation=True,
         speed=1,
         radius=10,
+        curves="",  # JSON file with other join/leave curves, see probabilities.py
         fps_limit=30,
     )
 )
@@ -0,0 +1,173 @@
+"""Clusters of agents, counted every frame.
+
+Two agents are in the same cluster when a chain of agents connects them in
+which every step is at most `radius` long (on the torus). For the aggregation
+without zones, the clusters of STILL agents are the aggregates, so their
+number and sizes say how well the swarm aggregated.
+
+`label_clusters(positions, radius)` works on arrays, so it scales to tens of
+thousands of agents:
+
+- candidate pairs come from a grid of cells one `radius` wide, like
+  `spatial_grid.TorusGrid`, so only the 3x3 block around a cell is checked
+  (`aggregation_engine` counts neighbours from the same pairs);
+- the pairs within `radius` are merged with a union-find that runs on whole
+  arrays: every root hooks onto the smallest root it is linked to, and then
+  pointers are shortcut to their roots, until no pair links two roots.
+
+`ClusterTracker` turns the labels of a frame into the cluster count, the size
+of the largest cluster, its fraction of the population and the size
+histogram, and `use_cluster_tracker(simulation, select)` feeds it after every
+frame (or every `every` frames):
+
+    clusters = use_cluster_tracker(simulation, lambda agent: agent.state == STILL).clusters
+    simulation.run()
+    clusters.to_frame()  # frame, agents, clusters, largest, largest_fraction
+    clusters.histogram_frame()  # frame, size, clusters
+"""
+import numpy as np
+import polars as pl
+
+from rolling import RollingStats
+
+WIDTH, HEIGHT = 1000, 1000
+
+
+def neighbour_pairs(positions, radius, width=WIDTH, height=HEIGHT):
+    """Index arrays `i, j` (with i < j) of the pairs of positions at most `radius` apart on the torus."""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    n = len(positions)
+    cols = max(1, int(width // radius))
+    rows = max(1, int(height // radius))
+    cx = (positions[:, 0] % width * cols // width).astype(int) % cols
+    cy = (positions[:, 1] % height * rows // height).astype(int) % rows
+    cell = cy * cols + cx
+
+    order = np.argsort(cell, kind="stable")
+    counts = np.bincount(cell, minlength=cols * rows)
+    starts = np.cumsum(counts) - counts
+    pairs_i, pairs_j = [], []
+
+    # On tiny grids -1 and +1 can wrap onto the same cell, which must only be visited once
+    for dx in {step % cols for step in (-1, 0, 1)}:
+        for dy in {step % rows for step in (-1, 0, 1)}:
+            neighbour_cell = ((cy + dy) % rows) * cols + (cx + dx) % cols
+            per_agent = counts[neighbour_cell]
+            i = np.repeat(np.arange(n), per_agent)
+            j = order[np.repeat(starts[neighbour_cell] - (np.cumsum(per_agent) - per_agent), per_agent)
+                      + np.arange(len(i))]
+
+            # Every pair turns up from both sides, keep it once
+            keep = i < j
+            i, j = i[keep], j[keep]
+            offset = positions[j] - positions[i]
+            offset[:, 0] -= width * np.round(offset[:, 0] / width)
+            offset[:, 1] -= height * np.round(offset[:, 1] / height)
+            near = (offset ** 2).sum(axis=1) <= radius ** 2
+            pairs_i.append(i[near])
+            pairs_j.append(j[near])
+
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def _shortcut(parent):
+    """Point every element straight at its root."""
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return parent
+        parent = grandparent
+
+
+def union_find(n, i, j):
+    """Root of every element 0 ... n-1 after merging the pairs `i, j`. A root is the smallest element of its set."""
+    parent = np.arange(n)
+    while len(i):
+        parent = _shortcut(parent)
+        root_i, root_j = parent[i], parent[j]
+        linked = root_i != root_j
+        if not linked.any():
+            break
+
+        # Hooking onto a smaller root only, so no cycles can form
+        i, j = i[linked], j[linked]
+        high = np.maximum(root_i[linked], root_j[linked])
+        low = np.minimum(root_i[linked], root_j[linked])
+        np.minimum.at(parent, high, low)
+    return _shortcut(parent)
+
+
+def label_clusters(positions, radius, width=WIDTH, height=HEIGHT):
+    """Cluster label of every position: the index of the first position in its cluster."""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    return union_find(len(positions), *neighbour_pairs(positions, radius, width, height))
+
+
+class ClusterTracker:
+    def __init__(self, radius, min_size=2, window=300, width=WIDTH, height=HEIGHT):
+        self.radius = radius
+        self.min_size = min_size  # Smaller groups of agents are not counted as clusters
+        self.width = width
+        self.height = height
+        self.rows = []  # (frame, agents that were selected, clusters, largest, largest fraction)
+        self.histograms = []  # (frame, size, clusters of that size)
+        # Rolling cluster count and largest cluster size, e.g. for `rolling.use_rolling_display`
+        self.rolling = {"clusters": RollingStats(window), "largest": RollingStats(window)}
+
+    def add(self, frame, positions, population=None):
+        """Find the clusters among `positions`. The largest fraction is relative to `population`, if given."""
+        labels = label_clusters(positions, self.radius, self.width, self.height)
+        sizes = np.bincount(labels, minlength=len(labels))
+        sizes = sizes[sizes >= self.min_size]
+
+        population = population or len(labels)
+        largest = int(sizes.max()) if len(sizes) else 0
+        fraction = largest / population if population else 0.0
+        self.rows.append((frame, len(labels), len(sizes), largest, fraction))
+        for size, clusters in enumerate(np.bincount(sizes)):
+            if clusters:
+                self.histograms.append((frame, size, int(clusters)))
+
+        self.rolling["clusters"].push(len(sizes))
+        self.rolling["largest"].push(largest)
+
+    def to_frame(self):
+        return pl.DataFrame(
+            self.rows,
+            schema=[
+                ("frame", pl.Int64), ("agents", pl.Int64), ("clusters", pl.Int64),
+                ("largest", pl.Int64), ("largest_fraction", pl.Float64),
+            ],
+            orient="row",
+        )
+
+    def histogram_frame(self):
+        return pl.DataFrame(self.histograms, schema=[("frame", pl.Int64), ("size", pl.Int64), ("clusters", pl.Int64)], orient="row")
+
+
+def use_cluster_tracker(simulation, select, radius=None, min_size=2, every=1, window=300):
+    """Track the clusters of the agents for which `select(agent)` is true, return the simulation.
+
+    The tracker, `simulation.clusters`, links agents within `radius` (the
+    proximity radius by default) and runs after every `every` frames. Agents
+    asleep in `simulation.dormancy` count too.
+    """
+    tracker = ClusterTracker(radius or simulation.config.radius, min_size, window)
+    after_update = simulation.after_update
+
+    def clustered_after_update():
+        after_update()
+        frame = simulation.shared.counter
+        if frame % every:
+            return
+
+        agents = simulation._agents.sprites()
+        dormancy = getattr(simulation, "dormancy", None)
+        if dormancy is not None:
+            agents += list(dormancy.sleeping)
+        positions = [(agent.pos.x, agent.pos.y) for agent in agents if select(agent)]
+        tracker.add(frame, positions, len(agents))
+
+    simulation.after_update = clustered_after_update
+    simulation.clusters = tracker
+    return simulation
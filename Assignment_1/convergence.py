@@ -0,0 +1,91 @@
+"""Steady-state detection, to stop aggregation runs once nothing changes any more.
+
+The zone occupancy of an aggregation run climbs for a while and then only
+fluctuates around its final level, so most of a fixed 60,000 frame run adds
+nothing. `SteadyState(window, tolerance)` follows one or more per-frame
+series (e.g. the number of agents per zone) in two adjacent windows: the last
+`window` frames and the `window` frames before them. A series is steady when
+the mean and the standard deviation of both windows differ by at most
+`tolerance`. Once all series are steady for `patience` frames in a row,
+`converged_at` is set to the frame where that happened.
+
+    steady = SteadyState(window=5000, tolerance=1.0)
+    steady.push(frame, [agents_in_zone_1, agents_in_zone_2])  # True once converged
+
+`use_steady_state(simulation, metric)` pushes `metric(simulation)` after
+every frame and stops the simulation when the series converged. The frame is
+kept in `simulation.steady_state.converged_at` (None if it never converged).
+With `stop=False` the frame is only recorded.
+
+A run can sit on a plateau for a long time before the aggregate grows (stage 1
+often stays at ~11 agents for 10,000+ frames and then climbs to ~90), and two
+windows on that plateau look steady. Longer windows, a `patience` and
+`min_frames` make an early stop on a plateau less likely, not impossible.
+"""
+from rolling import RollingStats
+
+
+class SteadyState:
+    def __init__(self, window=5000, tolerance=1.0, patience=1000, min_frames=0):
+        self.window = window
+        self.tolerance = tolerance
+        self.patience = patience
+        self.min_frames = min_frames
+        self.recent, self.previous = [], []  # Per series, RollingStats of the last window and the one before it
+        self.frames = 0
+        self.steady_for = 0  # Frames in a row that all series were steady
+        self.converged_at = None
+
+    @property
+    def converged(self):
+        return self.converged_at is not None
+
+    def is_steady(self):
+        """Whether every series has about the same mean and spread in both windows."""
+        return all(
+            abs(recent.mean - previous.mean) <= self.tolerance and abs(recent.std - previous.std) <= self.tolerance
+            for recent, previous in zip(self.recent, self.previous)
+        )
+
+    def push(self, frame, values):
+        """Add the values of the series for one frame, and return whether they converged (at this frame or before)."""
+        if not self.recent:
+            self.recent = [RollingStats(self.window) for _ in values]
+            self.previous = [RollingStats(self.window) for _ in values]
+
+        for recent, previous, value in zip(self.recent, self.previous, values):
+            # The value leaving the last window enters the one before it
+            old = recent.push(value)
+            if old is not None:
+                previous.push(old)
+        self.frames += 1
+
+        if self.converged_at is not None:
+            return True
+        if self.frames < max(2 * self.window, self.min_frames):
+            return False
+
+        self.steady_for = self.steady_for + 1 if self.is_steady() else 0
+        if self.steady_for >= self.patience:
+            self.converged_at = frame
+        return self.converged_at is not None
+
+
+def use_steady_state(simulation, metric, window=5000, tolerance=1.0, patience=1000, min_frames=0, stop=True):
+    """Push `metric(simulation)` (a sequence of numbers) after every frame and, with `stop`, stop once it converged.
+
+    Returns the simulation, with the detector in `simulation.steady_state`.
+    """
+    steady = SteadyState(window, tolerance, patience, min_frames)
+    after_update = simulation.after_update
+
+    def steady_after_update():
+        after_update()
+        if steady.converged:
+            return
+        if steady.push(simulation.shared.counter, metric(simulation)) and stop:
+            simulation.stop()
+
+    simulation.after_update = steady_after_update
+    simulation.steady_state = steady
+    return simulation
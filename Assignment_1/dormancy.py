@@ -0,0 +1,154 @@
+"""Dormant agents: agents that sleep until a given frame or until woken.
+
+An agent with nothing to do for a while, like a STILL aggregation agent that
+cannot leave yet, can be put to sleep with
+`simulation.dormancy.sleep(agent, frames)`. Until it wakes up it is
+
+- not moved (`change_position`) or updated (`update`);
+- not re-bucketed by the proximity grid every frame: it stays in the grid as a
+  static agent, so awake agents still find it as a neighbour;
+- still drawn and, unless `snapshots=False`, still in the snapshots, with the
+  position and image it fell asleep with plus the columns in its
+  `snapshot_data` dict (e.g. `{"kind": "Prey"}` for what `update` would save).
+
+It wakes up at the start of the frame after the skipped ones, or earlier when
+something calls `simulation.dormancy.wake(agent)`, e.g. because a neighbour
+moved. On waking, its `on_wake(frames)` method, if it has one, is called with
+the number of frames it skipped, to catch up on timers.
+
+    sim = use_dormancy(use_torus_grid(Simulation(config)))
+
+Agents reach the scheduler as `self.shared.dormancy`. The proximity engine has
+to support static agents, like `spatial_grid.TorusGrid`. Install the
+scheduler before `double_buffer.use_double_buffer`, which moves the agents
+from `before_update`.
+"""
+import heapq
+
+
+class DormancyScheduler:
+    def __init__(self, simulation, snapshots=True):
+        self.simulation = simulation
+        self.snapshots = snapshots
+        self.sleeping = {}  # Agent -> (last frame it ran, frame it wakes up at or None)
+        self.alarms = []  # Heap of (frame, agent id, agent), stale once the agent woke up or slept again
+        self.frame = -1  # Last frame in which awake agents have been (or are being) moved
+        self.rows = {}  # Agent -> its snapshot row without the frame, which stays the same while it sleeps
+
+    def __contains__(self, agent):
+        return agent in self.sleeping
+
+    def __len__(self):
+        return len(self.sleeping)
+
+    def _frame(self):
+        """The last frame in which awake agents have been (or are being) moved.
+
+        Kept as a number rather than worked out from `shared.counter`, which
+        violet already moves on to the next frame at the end of `tick`.
+        """
+        return self.frame
+
+    def sleep(self, agent, frames=None):
+        """Skip the agent for the next `frames` frames, or until `wake` if `frames` is None."""
+        if frames is not None and frames <= 0:
+            return
+
+        if agent in self.sleeping:
+            ran, _ = self.sleeping[agent]
+        else:
+            ran = self._frame()
+            self.simulation._agents.remove(agent)
+            self.simulation._proximity.add_static(agent)
+
+        wake_at = None if frames is None else self._frame() + frames + 1
+        self.sleeping[agent] = ran, wake_at
+        if wake_at is not None:
+            heapq.heappush(self.alarms, (wake_at, agent.id, agent))
+
+    def wake(self, agent):
+        """Wake the agent up, if it is asleep. It is moved again from the next frame on."""
+        if agent not in self.sleeping:
+            return
+
+        ran, _ = self.sleeping.pop(agent)
+        self.rows.pop(agent, None)
+        self.simulation._proximity.remove_static(agent)
+        if not agent.alive():
+            return
+
+        self.simulation._agents.add(agent)
+        if hasattr(agent, "on_wake"):
+            agent.on_wake(self._frame() - ran)
+
+    def _wake_due(self):
+        frame = self.simulation.shared.counter
+        while self.alarms and self.alarms[0][0] <= frame:
+            wake_at, _, agent = heapq.heappop(self.alarms)
+            if self.sleeping.get(agent, (None, None))[1] == wake_at:
+                self.wake(agent)
+
+        # Killed in their sleep
+        for agent in [agent for agent in self.sleeping if not agent.alive()]:
+            self.wake(agent)
+
+    def before_update(self):
+        self.frame = self.simulation.shared.counter - 1
+        self._wake_due()
+
+    def _row(self, agent, snapshots):
+        row = self.rows.get(agent)
+        if row is None:
+            # Let violet collect it once, then take it back out
+            lengths = {column: len(values) for column, values in snapshots.items()}
+            agent._collect_replay_data()
+            row = {
+                column: values.pop()
+                for column, values in snapshots.items()
+                if len(values) > lengths.get(column, 0)
+            }
+            del row["frame"]
+            self.rows[agent] = row
+        return row
+
+    def update(self, *args, **kwargs):
+        """Replaces `_all.update`: update the awake sprites and record the snapshots of the dormant agents."""
+        dormant = list(self.sleeping) if self.snapshots else []
+        if dormant:
+            # Violet collected the rows of the awake agents before updating, so the dormant rows go after them
+            snapshots = self.simulation._metrics._temporary_snapshots
+            rows = [self._row(agent, snapshots) for agent in dormant]
+            snapshots["frame"].extend([self.simulation.shared.counter] * len(rows))
+            for column in rows[0]:
+                snapshots[column].extend(row[column] for row in rows)
+
+        # Awake agents in the order violet collected their rows in, which a woken agent changed
+        awake = self.simulation._agents.sprites()
+        skip = set(awake) | set(self.sleeping)
+        for sprite in awake + [sprite for sprite in self.simulation._all.sprites() if sprite not in skip]:
+            sprite.update(*args, **kwargs)
+
+        # `save_data` columns line up with the rows as long as they are added in the same order
+        for agent in dormant:
+            for column, value in getattr(agent, "snapshot_data", {}).items():
+                agent.save_data(column, value)
+
+
+def use_dormancy(simulation, snapshots=True):
+    """Let agents sleep through frames (see `DormancyScheduler`) and return the simulation."""
+    if not hasattr(simulation._proximity, "add_static"):
+        raise TypeError("dormant agents need a proximity engine with static agents, e.g. use_torus_grid")
+
+    scheduler = DormancyScheduler(simulation, snapshots)
+    before_update = simulation.before_update
+
+    def dormancy_before_update():
+        scheduler.before_update()
+        before_update()
+        scheduler.frame = simulation.shared.counter
+
+    simulation.before_update = dormancy_before_update
+    simulation._all.update = scheduler.update
+    simulation.dormancy = scheduler
+    simulation.shared.dormancy = scheduler
+    return simulation
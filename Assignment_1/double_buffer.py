@@ -0,0 +1,60 @@
+"""Synchronous (double-buffered) agent updates.
+
+By default violet moves agents one at a time: `change_position` writes
+`self.pos` and `self.move` in place, so an agent later in the frame sees
+neighbours that have already moved. After `use_double_buffer(simulation)`,
+every agent with a `next_state` method is stepped in two phases at the start
+of each tick:
+
+1. read: `next_state()` is called for every agent. It reads the frame-t state
+   of the agent and its neighbours and returns the frame-t+1 state as a dict of
+   attribute names to values, without changing anything other agents read;
+2. write: all returned states are applied at once.
+
+The result of the read phase does not depend on the order of the agents, so
+it can run in chunks on an executor such as a
+`concurrent.futures.ThreadPoolExecutor`. Agents hold pygame surfaces and a
+reference to the simulation, so they cannot be sent to a process pool.
+Agents that draw from the shared `random` module are only reproducible
+without an executor.
+
+An agent's own `change_position` should apply `next_state` itself unless
+`double_buffered` is set, so the same agent also runs without the buffer.
+"""
+
+
+def apply_state(agent, state):
+    for name, value in state.items():
+        setattr(agent, name, value)
+
+
+def _next_states(agents):
+    return [agent.next_state() for agent in agents]
+
+
+def step_synchronously(agents, executor=None, chunk_size=256):
+    """Compute the next state of every agent from the current frame, then apply them all."""
+    if executor is None:
+        states = _next_states(agents)
+    else:
+        chunks = [agents[lo:lo + chunk_size] for lo in range(0, len(agents), chunk_size)]
+        states = [state for chunk in executor.map(_next_states, chunks) for state in chunk]
+
+    for agent, state in zip(agents, states):
+        apply_state(agent, state)
+
+
+def use_double_buffer(simulation, executor=None, chunk_size=256):
+    """Step the simulation's agents synchronously at the start of every tick and return the simulation."""
+    before_update = simulation.before_update
+
+    def synchronous_before_update():
+        before_update()
+        agents = [agent for agent in simulation._agents if hasattr(agent, "next_state") and agent.is_alive()]
+        for agent in agents:
+            # Turns their own `change_position` into a no-op
+            agent.double_buffered = True
+        step_synchronously(agents, executor, chunk_size)
+
+    simulation.before_update = synchronous_before_update
+    return simulation
@@ -0,0 +1,193 @@
+"""Multi-zone aggregation experiments, run in parallel and cached on disk.
+
+A layout is a list of zones `(x, y, radius)`, any number of them. Every
+replicate of every layout is one run of the batched engine
+(`aggregation_engine.BatchedAggregation`) on a process pool, and its
+per-frame agent counts per zone are cached in `.experiment_cache`, keyed by
+the hash of the layout, the config, the agents and frames, the curves file
+and the seed. Re-running a study, or adding layouts or replicates to it,
+only runs what is not in the cache yet.
+
+The stage 2 experiments ([80, 80], [100, 100], [130, 90], [140, 80]) are the
+default layouts:
+
+    python Assignment_1/experiments.py --replicates 20
+
+Other layouts, one `--layout` per layout with `x,y,radius` per zone, or a
+JSON file with a list of layouts:
+
+    python Assignment_1/experiments.py --layout 225,400,80 525,400,80 --layout 200,200,60 500,500,60 800,800,60
+    python Assignment_1/experiments.py --layouts layouts.json  # [[[225, 400, 80], [525, 400, 80]], ...]
+
+Replicate r of every layout runs with the same seed, derived from `--seed`,
+so layouts are compared on the same random numbers and a replicate never
+changes when the study around it does. The table has a row per layout,
+replicate and zone with the mean number of agents in the zone (over the whole
+run and over its last quarter) and the density.
+"""
+import argparse
+import dataclasses
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import polars as pl
+from pygame.math import Vector2
+
+from aggregation_engine import AggregationConfig, AggregationZone, BatchedAggregation
+from convergence import SteadyState
+
+CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".experiment_cache")
+CACHE_VERSION = 1  # Bump when the engine changes what a run computes, so old results are not reused
+STAGE2_LAYOUTS = [
+    [(225, 400, r1), (525, 400, r2)]
+    for r1, r2 in ([80, 80], [100, 100], [130, 90], [140, 80])
+]
+
+
+def parse_zone(text):
+    """`x,y,radius` gives a zone."""
+    try:
+        x, y, radius = (float(value) for value in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"a zone is x,y,radius, not {text!r}") from None
+    return x, y, radius
+
+
+def load_layouts(path):
+    """Layouts from a JSON file: a list of layouts, each a list of `[x, y, radius]` zones."""
+    with open(path) as f:
+        return [[tuple(float(value) for value in zone) for zone in layout] for layout in json.load(f)]
+
+
+def describe(layout):
+    return " ".join(f"{x:g},{y:g},{radius:g}" for x, y, radius in layout)
+
+
+def cache_key(layout, config, agents, frames, seed, steady=None):
+    """Hash of everything that decides the outcome of a replicate."""
+    values = dataclasses.asdict(config)
+    curves = values.pop("curves")
+    if curves:
+        # The file, not its name, decides the probabilities
+        with open(curves, "rb") as file:
+            values["curves"] = hashlib.sha1(file.read()).hexdigest()
+
+    description = {
+        "version": CACHE_VERSION,
+        "layout": [list(zone) for zone in layout],
+        "config": values,
+        "agents": agents,
+        "frames": frames,
+        "seed": seed,
+        "steady": steady,
+    }
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def run_replicate(layout, config, agents, frames, seed, steady=None, cache=CACHE):
+    """Agents per zone per frame for one replicate, from the cache or from a new run (which is then cached)."""
+    path = os.path.join(cache, f"{cache_key(layout, config, agents, frames, seed, steady)}.npz")
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            return cached["counts"], int(cached["converged_at"])
+
+    zones = [AggregationZone(Vector2(x, y), radius) for x, y, radius in layout]
+    detector = SteadyState(*steady) if steady else None
+    counts = BatchedAggregation(config, zones, agents, seed=seed, images=len(zones) + 1).run(frames, detector)
+    counts = counts[:, 1:]  # Image index 0 is outside the zones
+    converged_at = detector.converged_at if detector and detector.converged else -1
+
+    # Written under another name first, so an interrupted run never leaves half a file behind
+    os.makedirs(cache, exist_ok=True)
+    partial = f"{path[:-4]}.{os.getpid()}.npz"
+    np.savez_compressed(partial, counts=counts, converged_at=converged_at)
+    os.replace(partial, path)
+    return counts, converged_at
+
+
+def summarise(layout_index, layout, replicate, seed, counts, converged_at):
+    tail = counts[-max(1, len(counts) // 4):]
+    return [
+        {
+            "layout": layout_index,
+            "zones": describe(layout),
+            "replicate": replicate,
+            "seed": seed,
+            "zone": zone,
+            "radius": radius,
+            "frames": len(counts),
+            "converged_at": converged_at if converged_at >= 0 else None,
+            "agents": float(counts[:, zone].mean()),
+            "agents_final": float(tail[:, zone].mean()),
+            "density": float(counts[:, zone].mean()) / (math.pi * radius ** 2),
+        }
+        for zone, (_, _, radius) in enumerate(layout)
+    ]
+
+
+def run_study(layouts, replicates, config, agents=100, frames=1000 * 60, seed=0, steady=None, workers=None, cache=CACHE):
+    """Run (or load) every replicate of every layout and collect the per-zone summaries in one DataFrame."""
+    seeds = [seed * 1_000_003 + replicate for replicate in range(replicates)]
+    jobs = [(index, layout, replicate) for index, layout in enumerate(layouts) for replicate in range(replicates)]
+    cached = sum(
+        os.path.exists(os.path.join(cache, f"{cache_key(layout, config, agents, frames, seeds[replicate], steady)}.npz"))
+        for _, layout, replicate in jobs
+    )
+    print(f"{len(jobs)} replicates, {cached} cached, {len(jobs) - cached} to run")
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [
+            pool.submit(run_replicate, layout, config, agents, frames, seeds[replicate], steady, cache)
+            for _, layout, replicate in jobs
+        ]
+        rows = []
+        for (index, layout, replicate), future in zip(jobs, futures):
+            counts, converged_at = future.result()
+            rows.extend(summarise(index, layout, replicate, seeds[replicate], counts, converged_at))
+    return pl.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--layout", action="append", nargs="+", type=parse_zone, dest="layouts",
+                        help="one layout: x,y,radius per zone (repeat for more layouts)")
+    parser.add_argument("--layouts", dest="layouts_file", help="JSON file with a list of layouts")
+    parser.add_argument("--replicates", type=int, default=10)
+    parser.add_argument("--frames", type=int, default=1000 * 60)
+    parser.add_argument("--agents", type=int, default=100)
+    parser.add_argument("--speed", type=float, default=10)
+    parser.add_argument("--radius", type=float, default=10)
+    parser.add_argument("--curves", default="", help="JSON file with other join/leave curves, see probabilities.py")
+    parser.add_argument("--window", type=int, help="stop a replicate once the zones are steady, see convergence.py")
+    parser.add_argument("--tolerance", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--cache", default=CACHE)
+    parser.add_argument("--out", default="Assignment_1/results_stage2/experiments.csv")
+    args = parser.parse_args()
+
+    layouts = (args.layouts or []) + (load_layouts(args.layouts_file) if args.layouts_file else [])
+    config = AggregationConfig(speed=args.speed, radius=args.radius, curves=args.curves)
+    steady = (args.window, args.tolerance) if args.window else None
+    table = run_study(
+        layouts or STAGE2_LAYOUTS,
+        args.replicates,
+        config,
+        agents=args.agents,
+        frames=args.frames,
+        seed=args.seed,
+        steady=steady,
+        workers=args.workers,
+        cache=args.cache,
+    )
+    table.write_csv(args.out)
+    print(table.group_by("layout", "zones", "zone", maintain_order=True).agg(pl.col("agents", "agents_final", "density").mean()))
+    print(f"Saved experiments to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Static overlay: things that never move, drawn once instead of every frame.
+
+Violet wipes the screen at the start of every frame by blitting the
+simulation's background. `use_static_overlay(sim, *layers)` draws the layers
+(functions that draw onto a surface, like `draw_zones(zones)`) into a copy of
+that background once, so they show up on every frame for the price of a
+blit that happens anyway. Call `sim.overlay.invalidate()` after changing
+something a layer draws, e.g. moving a zone.
+
+A `HeadlessSimulation` has no background, so there the overlay keeps its
+layers but never draws anything.
+"""
+import pygame as pg
+
+
+class StaticOverlay:
+    def __init__(self, simulation, layers=()):
+        self.simulation = simulation
+        self.layers = list(layers)
+        self.base = simulation._background.copy() if hasattr(simulation, "_background") else None
+        self.invalidate()
+
+    def add(self, layer):
+        self.layers.append(layer)
+        self.invalidate()
+
+    def invalidate(self):
+        """Redraw every layer onto a clean copy of the background."""
+        if self.base is None:
+            return
+
+        background = self.base.copy()
+        for layer in self.layers:
+            layer(background)
+        self.simulation._background = background
+
+
+def draw_zones(zones, colour=(255, 255, 0), width=2):
+    """Layer that outlines circular zones (anything with a `pos` and a `radius`)."""
+    def draw(surface):
+        for zone in zones:
+            pg.draw.circle(surface, colour, (int(zone.pos.x), int(zone.pos.y)), int(zone.radius), width=width)
+    return draw
+
+
+def use_static_overlay(simulation, *layers):
+    """Draw the layers into the simulation's background, keep them as `simulation.overlay`, return the simulation."""
+    simulation.overlay = StaticOverlay(simulation, layers)
+    return simulation
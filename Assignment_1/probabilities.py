@@ -0,0 +1,96 @@
+"""Join and leave probabilities as lookup tables.
+
+An aggregation agent with n neighbours joins with
+PJoin = 0.03 + 0.48 * (1 - exp(-a * n)) and leaves with PLeave = exp(-b * n).
+n is a small whole number, so `load_tables` evaluates both curves once for
+n = 0 ... `size - 1`. After that a lookup is a list index (`join[n]`) for an
+agent, or a gather from an array (`join.gather(counts)`) for a batched engine.
+Counts past the end get the last entry, where the curves have flattened out.
+
+Other curves come from a JSON file, without any extra cost per lookup:
+
+    {
+        "join": "0.05 + 0.5 * (1 - exp(-2 * n))",
+        "leave": [1.0, 0.1, 0.01, 0.0]
+    }
+
+A curve is either an expression in `n` (with the functions of `math`) or the
+probabilities for n = 0, 1, 2, ... A curve the file leaves out keeps its
+default. `curves/default.json` spells out the default curves.
+
+The aggregation configs derive from `ProbabilityConfig`, which holds `a`, `b`
+and the `curves` file and builds the tables once per config:
+
+    join, leave = self.config.tables
+    PJoin = join[n]
+"""
+import json
+import math
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+from vi import Config
+
+SIZE = 64  # Neighbour counts with an entry of their own
+
+
+def join_curve(a):
+    return lambda n: 0.03 + 0.48 * (1 - math.exp(-a * n))
+
+
+def leave_curve(b):
+    return lambda n: math.exp(-b * n)
+
+
+def _curve(entry):
+    if isinstance(entry, str):
+        code = compile(entry, "<curve>", "eval")
+        namespace = {name: getattr(math, name) for name in dir(math) if not name.startswith("_")}
+        namespace["__builtins__"] = {}
+        return lambda n: eval(code, namespace, {"n": n})
+    if isinstance(entry, list) and entry:
+        return lambda n: entry[min(n, len(entry) - 1)]
+    raise ValueError(f"a curve is an expression in n or a list of probabilities, not {entry!r}")
+
+
+class ProbabilityTable:
+    def __init__(self, curve, size=SIZE):
+        self.values = [float(curve(n)) for n in range(size)]
+        self.array = np.array(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, n):
+        values = self.values
+        return values[n] if n < len(values) else values[-1]
+
+    def gather(self, counts):
+        """The probabilities for an array of neighbour counts."""
+        return self.array[np.minimum(counts, len(self.array) - 1)]
+
+
+def load_tables(a=1.70188, b=3.88785, path=None, size=SIZE):
+    """PJoin and PLeave tables for the default curves with `a` and `b`, or those in the JSON file at `path`."""
+    join, leave = join_curve(a), leave_curve(b)
+    if path:
+        with open(path) as f:
+            curves = json.load(f)
+        if "join" in curves:
+            join = _curve(curves["join"])
+        if "leave" in curves:
+            leave = _curve(curves["leave"])
+    return ProbabilityTable(join, size), ProbabilityTable(leave, size)
+
+
+@dataclass
+class ProbabilityConfig(Config):
+    a: float = 1.70188
+    b: float = 3.88785
+    curves: str = ""  # JSON file with other join/leave curves
+
+    @cached_property
+    def tables(self):
+        """PJoin and PLeave lookup tables, indexed by the number of neighbours."""
+        return load_tables(self.a, self.b, self.curves)
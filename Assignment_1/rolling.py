@@ -0,0 +1,169 @@
+"""Rolling statistics of per-frame metrics, kept up to date while the simulation runs.
+
+`RollingStats(window)` holds the last `window` values of a stream in a ring
+buffer, with running sums, so `push` and `mean` cost the same however long
+the run is. `variance` uses ddof=1 like polars' `rolling_var`, and
+`quantile(q)` sorts the window when it is asked for.
+
+`RollingMonitor` keeps one `RollingStats` per named metric plus the history
+of values and means, which is the smoothed curve the scripts used to build
+with `rolling_mean(...).over(...)` after the run:
+
+    monitor = RollingMonitor(window=500)
+    monitor.push(frame, inside=12, outside=88)
+    monitor.to_frame()  # frame, metric, value, mean
+
+`use_rolling_monitor(simulation, {"name": function})` pushes the metrics
+every frame, and `use_rolling_display(simulation, stats)` draws the current
+mean, standard deviation, 10-90% range and a sparkline of every stream in a
+corner of the window. Headless simulations have no window, so there the
+display is not installed.
+"""
+import math
+
+import numpy as np
+import polars as pl
+import pygame as pg
+
+
+class RollingStats:
+    def __init__(self, window):
+        self.window = window
+        self.buffer = np.zeros(window)
+        self.count = 0  # Values pushed so far
+        self.total = 0.0
+        self.total_squared = 0.0
+
+    def __len__(self):
+        return min(self.count, self.window)
+
+    def push(self, value):
+        """Add a value, and return the one that dropped out of the window (None while the window fills up)."""
+        index = self.count % self.window
+        old = None
+        if self.count >= self.window:
+            old = float(self.buffer[index])
+            self.total -= old
+            self.total_squared -= old * old
+        self.buffer[index] = value
+        self.total += value
+        self.total_squared += value * value
+        self.count += 1
+
+        # Start the sums over once per lap, so rounding errors cannot pile up
+        if self.count % self.window == 0:
+            self.total = float(self.buffer.sum())
+            self.total_squared = float(np.dot(self.buffer, self.buffer))
+        return old
+
+    def values(self):
+        """The values in the window, oldest first."""
+        if self.count <= self.window:
+            return self.buffer[:self.count].copy()
+        return np.roll(self.buffer, -(self.count % self.window))
+
+    @property
+    def mean(self):
+        return self.total / len(self) if self.count else math.nan
+
+    @property
+    def variance(self):
+        n = len(self)
+        if n < 2:
+            return math.nan
+        return max(0.0, (self.total_squared - self.total * self.total / n) / (n - 1))
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def quantile(self, q):
+        return float(np.quantile(self.buffer[:len(self)], q)) if self.count else math.nan
+
+
+class RollingMonitor:
+    def __init__(self, window=500):
+        self.window = window
+        self.stats = {}  # Metric name -> RollingStats
+        self.history = []  # (frame, metric, value, rolling mean)
+
+    def push(self, frame, **values):
+        for name, value in values.items():
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = RollingStats(self.window)
+            stats.push(value)
+            self.history.append((frame, name, value, stats.mean))
+
+    def to_frame(self):
+        return pl.DataFrame(
+            self.history,
+            schema=[("frame", pl.Int64), ("metric", pl.Utf8), ("value", pl.Float64), ("mean", pl.Float64)],
+            orient="row",
+        )
+
+
+class RollingDisplay:
+    def __init__(self, stats, labels=None, colour=(255, 255, 255), width=160, height=24):
+        self.stats = stats
+        self.labels = dict(labels or {})
+        self.colour = colour
+        self.width = width
+        self.height = height
+        pg.font.init()
+        self.font = pg.font.Font(None, 18)
+
+    def draw(self, surface):
+        y = 8
+        for name, stats in self.stats.items():
+            if not stats.count:
+                continue
+
+            label = self.labels.get(name, name)
+            std = stats.std if len(stats) > 1 else 0.0
+            text = f"{label}: {stats.mean:.1f} ± {std:.1f} [{stats.quantile(0.1):.0f}, {stats.quantile(0.9):.0f}]"
+            surface.blit(self.font.render(text, True, self.colour), (8, y))
+            y += 16
+
+            values = stats.values()
+            if len(values) > 1:
+                low, high = values.min(), values.max()
+                scale = (self.height - 1) / (high - low) if high > low else 0
+                xs = np.linspace(8, 8 + self.width, len(values))
+                ys = y + self.height - 1 - (values - low) * scale
+                pg.draw.lines(surface, self.colour, False, np.column_stack((xs, ys)).tolist())
+            y += self.height + 6
+
+
+def use_rolling_display(simulation, stats, labels=None, colour=(255, 255, 255)):
+    """Draw the rolling statistics (a dict of name to `RollingStats`) on top of every frame, return the simulation."""
+    if not hasattr(simulation, "_screen"):
+        return simulation
+
+    display = RollingDisplay(stats, labels, colour)
+    draw = simulation._all.draw
+
+    def draw_with_stats(surface):
+        draw(surface)
+        display.draw(surface)
+
+    # Violet draws every sprite with `_all.draw(screen)` right before flipping the display
+    simulation._all.draw = draw_with_stats
+    simulation.rolling_display = display
+    return simulation
+
+
+def use_rolling_monitor(simulation, metrics, window=500, display=True):
+    """Push `metrics` (name to `function(simulation)`) after every frame into `simulation.rolling`, return the simulation."""
+    monitor = RollingMonitor(window)
+    after_update = simulation.after_update
+
+    def monitored_after_update():
+        after_update()
+        monitor.push(simulation.shared.counter, **{name: metric(simulation) for name, metric in metrics.items()})
+
+    simulation.after_update = monitored_after_update
+    simulation.rolling = monitor
+    if display:
+        use_rolling_display(simulation, monitor.stats)
+    return simulation
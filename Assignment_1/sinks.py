@@ -0,0 +1,73 @@
+"""Snapshot sinks: reduce the snapshots while the simulation runs.
+
+Violet keeps one snapshot row per agent per frame, so a 60,000 frame run with
+100 agents ends with 6,000,000 rows, which the aggregation scripts then group
+into a few rows per frame. After `use_snapshot_sink(simulation, *sinks)`,
+every frame's rows are handed to the sinks (`sink.add(columns)`, with
+`columns` the frame's rows as a dict of column lists) as soon as they are
+collected, and are not kept unless `keep_snapshots=True`.
+
+`FrameCounts` is the reduction of the aggregation scripts: the number of
+agents per frame and image index, and its rolling mean per image index:
+
+    counts = FrameCounts("image_index", window=500)
+    use_snapshot_sink(simulation, counts).batch_spawn_agents(...).run()
+    counts.to_frame()  # frame, image_index, agents, agents_smoothed
+"""
+from collections import Counter
+
+import polars as pl
+
+from rolling import RollingStats
+
+
+class FrameCounts:
+    def __init__(self, by="image_index", window=500):
+        self.by = by
+        self.window = window
+        self.frames, self.groups, self.counts, self.smoothed = [], [], [], []
+        self.rolling = {}  # Group -> RollingStats of its counts, e.g. for `rolling.use_rolling_display`
+        self.latest = Counter()  # Group -> its count in the last frame
+
+    def add(self, columns):
+        """Count the agents of one frame per group, and update the rolling means."""
+        frames = columns.get("frame")
+        if not frames:
+            return
+
+        self.latest = Counter(columns[self.by])
+        for group, count in sorted(self.latest.items()):
+            stats = self.rolling.get(group)
+            if stats is None:
+                stats = self.rolling[group] = RollingStats(self.window)
+            stats.push(count)
+
+            self.frames.append(frames[0])
+            self.groups.append(group)
+            self.counts.append(count)
+            self.smoothed.append(stats.mean)
+
+    def to_frame(self):
+        """Like grouping the snapshots by frame and group and taking a rolling mean (with min_periods=1) per group."""
+        return pl.DataFrame(
+            {"frame": self.frames, self.by: self.groups, "agents": self.counts, "agents_smoothed": self.smoothed},
+            schema_overrides={"agents": pl.UInt32},
+        ).sort([self.by, "frame"])
+
+
+def use_snapshot_sink(simulation, *sinks, keep_snapshots=False):
+    """Hand every frame's snapshot rows to the sinks, keep them only with `keep_snapshots`, return the simulation."""
+    metrics = simulation._metrics
+    merge = metrics._merge
+
+    def merge_into_sinks():
+        for sink in sinks:
+            sink.add(metrics._temporary_snapshots)
+        if keep_snapshots:
+            merge()
+        else:
+            metrics._temporary_snapshots.clear()
+
+    # Violet merges the rows collected during a tick into `snapshots` at the end of it
+    metrics._merge = merge_into_sinks
+    return simulation
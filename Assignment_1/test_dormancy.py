@@ -0,0 +1,92 @@
+"""Frame accounting of `dormancy.DormancyScheduler`: sleeping agents lose no frames and gain none.
+
+An agent that counts its frames in `update` and catches up in `on_wake`
+must end up with the count of an agent that never slept, and run again
+exactly `frames` frames after the frame it fell asleep in. Sleeps start from
+inside `update` (during the frame) and from code that runs after `tick`, like
+`AggregationSimulation.rest` in aggregation_stage2.py.
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from vi import Agent, Config, HeadlessSimulation
+
+from dormancy import use_dormancy
+from spatial_grid import use_torus_grid
+
+IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images", "triangle.png")
+FRAMES = 30
+
+
+class Ticker(Agent):
+    naps = {}  # Frame -> frames to sleep, started from the agent's own update
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timer = 0
+        self.ran = []
+
+    def change_position(self):
+        pass
+
+    def update(self):
+        frame = self.shared.counter
+        self.timer += 1
+        self.ran.append(frame)
+        if frame in self.naps:
+            self.shared.dormancy.sleep(self, self.naps[frame])
+
+    def on_wake(self, frames):
+        self.timer += frames
+
+
+def run(inside, after):
+    """Run FRAMES frames with sleeps from inside `update` and after `tick`, return the agent."""
+    Ticker.naps = inside
+    simulation = use_dormancy(use_torus_grid(HeadlessSimulation(Config(seed=1))))
+    simulation.batch_spawn_agents(1, Ticker, images=[IMAGE])
+    agent = simulation._agents.sprites()[0]
+
+    for frame in range(FRAMES):
+        simulation.tick()
+        if frame in after:
+            simulation.dormancy.sleep(agent, after[frame])
+    return agent
+
+
+def expected_frames(*sleeps):
+    skipped = {
+        skipped
+        for naps in sleeps
+        for frame, frames in naps.items()
+        for skipped in range(frame + 1, frame + frames + 1)
+    }
+    return [frame for frame in range(FRAMES) if frame not in skipped]
+
+
+def test_without_sleeping():
+    agent = run({}, {})
+    assert agent.ran == list(range(FRAMES))
+    assert agent.timer == FRAMES
+
+
+def test_sleep_inside_update():
+    inside = {2: 3, 15: 1}
+    agent = run(inside, {})
+    assert agent.ran == expected_frames(inside)
+    assert agent.timer == FRAMES
+
+
+def test_sleep_after_tick():
+    after = {0: 3, 20: 4}
+    agent = run({}, after)
+    assert agent.ran == expected_frames(after)
+    assert agent.timer == FRAMES
+
+
+def test_sleep_inside_update_and_after_tick():
+    inside, after = {2: 3, 15: 1}, {7: 3, 20: 4}
+    agent = run(inside, after)
+    assert agent.ran == expected_frames(inside, after)
+    assert agent.timer == FRAMES
@@ -0,0 +1,27 @@
+"""Zone membership for many agents at once.
+
+`zone_membership` tests every position against every zone in one NumPy pass
+and returns, per agent, the index of the zone it is in (-1 for none). A
+simulation computes it once per frame and hands it to both its agents and its
+trackers, instead of every agent and every tracker redoing the distance tests.
+"""
+import numpy as np
+
+
+def zone_membership(positions, zones):
+    """Index of the zone every `(x, y)` position is in, the first one if zones overlap, or -1 outside all zones."""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    if not zones:
+        return np.full(len(positions), -1)
+
+    centres = np.array([(zone.pos.x, zone.pos.y) for zone in zones])
+    radii = np.array([zone.radius for zone in zones])
+
+    offset = positions[:, None, :] - centres[None, :, :]
+    inside = (offset ** 2).sum(axis=2) < radii ** 2
+    return np.where(inside.any(axis=1), inside.argmax(axis=1), -1)
+
+
+def zone_counts(membership, zone_count):
+    """Number of agents in each zone."""
+    return np.bincount(membership[membership >= 0], minlength=zone_count)
@@ -4,6 +4,7 @@ from vi import Agent, Config, Simulation
 from pygame.math import Vector2
 import random
 import math
+from lod_render import use_lod_renderer
 
 @dataclass
 class SimConfig(Config):
@@ -170,7 +171,7 @@ class AttackerDragon(Agent):
 
 # Run simulation
 result_df = (
-    Simulation(config=SimConfig())
+    use_lod_renderer(Simulation(config=SimConfig()), {"Prey": 2000, "Predator": 2000})
     .spawn_agent(Castle, images=["Assignment_2/images/barn.png"])
     .batch_spawn_agents(60, Prey, images=["Assignment_2/images/prey_small.png"])
     .batch_spawn_agents(20, Predator, images=["Assignment_2/images/predator_small.png"])
@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 from vi import Agent, Config, HeadlessSimulation
 from pygame.math import Vector2
+from spatial_grid import Flag, GridAgent, use_torus_grid
 import random
 import math
 import os
@@ -59,7 +60,9 @@ class Castle(Agent):
         for prey in to_remove:
             self.leave(prey)
 
-class Prey(Agent):
+class Prey(GridAgent, Agent):
+    in_castle = Flag()  # Indexed by the grid, so hunters can leave sheltered prey out of their queries
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.in_castle = False
@@ -84,7 +87,7 @@ class Prey(Agent):
 
         self.save_data('kind', 'Prey')
 
-        for agent, dist in self.in_proximity_accuracy().filter_kind(Castle):
+        for agent, dist in self.in_proximity_accuracy(kind=Castle, radius=self.config.detection_radius):
             if dist < self.config.detection_radius:
                 if (self.pos - agent.pos).length() <= agent.config.castle_radius and agent.allow_entry(self):
                     self.enter_castle(agent)
@@ -121,7 +124,7 @@ class Prey(Agent):
         self.castle_timer = 0
         self.current_castle = None
 
-class Predator(Agent):
+class Predator(GridAgent, Agent):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.has_eaten = False
@@ -131,7 +134,17 @@ class Predator(Agent):
         global TOTAL_PREY
         self.save_data('kind', 'Predator')
 
-        for agent, dist in self.in_proximity_accuracy().filter_kind(Castle):
+        # Castles and the prey outside them from one scan, before the step. Prey within a step more than the
+        # eating radius, so it includes all prey within eating range after the step.
+        castles, preys = self.in_proximity_kinds(
+            Castle,
+            Prey,
+            radius=(self.config.detection_radius, self.config.eating_radius + self.config.speed),
+            flags={"in_castle": False},
+        )
+
+        # Castle avoidance
+        for agent, dist in castles:
             if dist < self.config.detection_radius:
                 repel = (self.pos - agent.pos)
                 if repel.length() > 0:
@@ -141,8 +154,9 @@ class Predator(Agent):
         self.move = self.move.normalize() * self.config.speed
         self.pos += self.move
 
-        for prey, dist in self.in_proximity_accuracy().filter_kind(Prey):
-            if not prey.in_castle and dist < self.config.eating_radius:
+        # Hunting, from where the step took it
+        for prey, _ in preys:
+            if self.distance_to(prey) < self.config.eating_radius:
                 prey.kill()
                 self.has_eaten = True
                 if random.random() < self.config.predator_reproduction_chance:
@@ -153,7 +167,7 @@ class Predator(Agent):
             self.kill()
         self.has_eaten = False
 
-class ProtectorDragon(Agent):
+class ProtectorDragon(GridAgent, Agent):
     speed = 2.5
 
     def __init__(self, *args, **kwargs):
@@ -163,10 +177,10 @@ class ProtectorDragon(Agent):
     def update(self):
         self.save_data('kind', 'ProtectorDragon')
 
-        predators = list(self.in_proximity_accuracy().filter_kind(Predator))
+        nearest = self.nearest(Predator, max_radius=self.config.radius)
 
-        if predators:
-            closest_predator, distance = min(predators, key=lambda p: p[1])
+        if nearest:
+            closest_predator, distance = nearest[0]
             direction = closest_predator.pos - self.pos
             if direction.length() > 0:
                 direction = direction.normalize()
@@ -189,7 +203,7 @@ for i in range(num_runs):
     TOTAL_PREY = 0  # Reset before each run
 
     result_df = (
-        HeadlessSimulation(config=SimConfig())
+        use_torus_grid(HeadlessSimulation(config=SimConfig()))
         .spawn_agent(Castle, images=["Assignment_2/images/barn.png"])
         .batch_spawn_agents(50, Prey, images=["Assignment_2/images/prey_small.png"])
         .batch_spawn_agents(25, Predator, images=["Assignment_2/images/predator_small.png"])
@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 from vi import Agent, Config, HeadlessSimulation
 from pygame.math import Vector2
+from spatial_grid import Flag, GridAgent, use_torus_grid
 import random
 import math
 import datetime
@@ -60,7 +61,9 @@ class Castle(Agent):
         for prey in to_remove:
             self.leave(prey)
 
-class Prey(Agent):
+class Prey(GridAgent, Agent):
+    in_castle = Flag()  # Indexed by the grid, so hunters can leave sheltered prey out of their queries
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.in_castle = False
@@ -85,7 +88,7 @@ class Prey(Agent):
 
         self.save_data('kind', 'Prey')
 
-        for agent, dist in self.in_proximity_accuracy().filter_kind(Castle):
+        for agent, dist in self.in_proximity_accuracy(kind=Castle, radius=self.config.detection_radius):
             if dist < self.config.detection_radius:
                 if (self.pos - agent.pos).length() <= agent.config.castle_radius and agent.allow_entry(self):
                     self.enter_castle(agent)
@@ -118,7 +121,7 @@ class Prey(Agent):
         self.castle_timer = 0
         self.current_castle = None
 
-class Predator(Agent):
+class Predator(GridAgent, Agent):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.has_eaten = False
@@ -128,7 +131,17 @@ class Predator(Agent):
         global TOTAL_PREY
         self.save_data('kind', 'Predator')
 
-        for agent, dist in self.in_proximity_accuracy().filter_kind(Castle):
+        # Castles and the prey outside them from one scan, before the step. Prey within a step more than the
+        # eating radius, so it includes all prey within eating range after the step.
+        castles, preys = self.in_proximity_kinds(
+            Castle,
+            Prey,
+            radius=(self.config.detection_radius, self.config.eating_radius + self.config.speed),
+            flags={"in_castle": False},
+        )
+
+        # Castle avoidance
+        for agent, dist in castles:
             if dist < self.config.detection_radius:
                 repel = (self.pos - agent.pos).normalize()
                 self.move += repel * self.config.repel_strength * 2.0
@@ -136,8 +149,9 @@ class Predator(Agent):
         self.move = self.move.normalize() * self.config.speed
         self.pos += self.move
 
-        for prey, dist in self.in_proximity_accuracy().filter_kind(Prey):
-            if not prey.in_castle and dist < self.config.eating_radius:
+        # Hunting, from where the step took it
+        for prey, _ in preys:
+            if self.distance_to(prey) < self.config.eating_radius:
                 prey.kill()
                 self.has_eaten = True
                 if random.random() < self.config.predator_reproduction_chance:
@@ -149,26 +163,21 @@ class Predator(Agent):
 
         self.has_eaten = False
 
-class AttackerDragon(Agent):
+class AttackerDragon(GridAgent, Agent):
     dragon_speed = 1.2
 
     def update(self):
         self.save_data('kind', "AttackerDragon")
-
-        for agent, dist in self.in_proximity_accuracy().filter_kind(Castle):
+        for agent, dist in self.in_proximity_accuracy(kind=Castle, radius=self.config.detection_radius):
             if dist < self.config.detection_radius:
                 repel = (self.pos - agent.pos)
                 if repel.length() > 0:
                     repel = repel.normalize()
                 self.move += repel * self.config.repel_strength * 2.0
 
-        prey = (
-            self.in_proximity_accuracy()
-            .without_distance()
-            .filter_kind(Prey)
-            .filter(lambda p: not p.in_castle)
-            .first()
-        )
+        # The nearest prey outside the castle
+        nearest = self.nearest(Prey, max_radius=self.config.radius, flags={"in_castle": False})
+        prey = nearest[0][0] if nearest else None
 
         if prey is not None:
             direction = prey.pos - self.pos
@@ -189,7 +198,7 @@ for i in range(1, 3):
     TOTAL_PREY = 0
 
     result_df = (
-        HeadlessSimulation(config=SimConfig())
+        use_torus_grid(HeadlessSimulation(config=SimConfig()))
         .spawn_agent(Castle, images=["Assignment_2/images/barn.png"])
         .batch_spawn_agents(60, Prey, images=["Assignment_2/images/prey_small.png"])
         .batch_spawn_agents(20, Predator, images=["Assignment_2/images/predator_small.png"])
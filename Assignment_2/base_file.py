@@ -4,6 +4,7 @@ import random
 import polars as pl
 import matplotlib.pyplot as plt
 import datetime
+from lod_render import use_lod_renderer
 
 @dataclass
 class SimConfig(Config): #switch numbers here for different results
@@ -56,7 +57,7 @@ class Predator(Agent):
 
 # Launch simulation
 result_df = (
-    Simulation(config=SimConfig(duration=60 * 60 * 0.5))
+    use_lod_renderer(Simulation(config=SimConfig(duration=60 * 60 * 0.5)), {"Prey": 2000, "Predator": 2000})
     .batch_spawn_agents(60, Prey, images=["Assignment_2/images/prey_small.png"])
     .batch_spawn_agents(20, Predator, images=["Assignment_2/images/predator_small.png"])
     .run()
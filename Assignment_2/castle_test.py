@@ -6,6 +6,8 @@ import matplotlib.pyplot as plt
 import datetime
 import math
 from pygame.math import Vector2
+from spatial_grid import Flag, GridAgent, use_torus_grid
+from dormancy import use_dormancy
 
 # Global prey count
 TOTAL_PREY = 0
@@ -60,7 +62,11 @@ class Castle(Agent):
             self.preys_in_castle.pop(prey, None)
 
 
-class Prey(Agent):
+class Prey(GridAgent, Agent):
+    in_castle = Flag()  # Indexed by the grid, so hunters can leave sheltered prey out of their queries
+
+    snapshot_data = {'kind': 'Prey'}  # Saved for it while it sleeps in a castle
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.in_castle = False
@@ -85,7 +91,7 @@ class Prey(Agent):
         else:
             self.save_data('kind', 'Prey')
 
-        for agent, dist in self.in_proximity_accuracy().filter_kind(Castle):
+        for agent, dist in self.in_proximity_accuracy(kind=Castle, radius=self.config.detection_radius):
             if dist < self.config.detection_radius:
                 castle = agent
                 if (self.pos - castle.pos).length() <= castle.config.castle_radius and castle.allow_entry(self):
@@ -110,6 +116,11 @@ class Prey(Agent):
         self.current_castle = castle
         castle.enter(self)
         self.move = Vector2(0, 0)
+        # Nothing to do but count down, so sleep until the frame it has to leave in
+        self.shared.dormancy.sleep(self, self.config.max_castle_stay - 1)
+
+    def on_wake(self, frames):
+        self.castle_timer += frames
 
     def leave_castle(self):
         if self.current_castle:
@@ -126,7 +137,7 @@ class Prey(Agent):
         self.current_castle = None
 
 
-class Predator(Agent):
+class Predator(GridAgent, Agent):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.has_eaten = False
@@ -136,8 +147,17 @@ class Predator(Agent):
         global TOTAL_PREY
         self.save_data('kind', 'Predator')
 
+        # Castles and the prey outside them from one scan, before the step. Prey within a step more than the
+        # eating radius, so it includes all prey within eating range after the step.
+        castles, preys = self.in_proximity_kinds(
+            Castle,
+            Prey,
+            radius=(self.config.detection_radius, self.config.eating_radius + self.config.speed),
+            flags={"in_castle": False},
+        )
+
         # Castle avoidance
-        for agent, dist in self.in_proximity_accuracy().filter_kind(Castle):
+        for agent, dist in castles:
             if dist < self.config.detection_radius:
                 castle = agent
                 repel = (self.pos - castle.pos)
@@ -148,9 +168,9 @@ class Predator(Agent):
         self.move = self.move.normalize() * self.config.speed
         self.pos += self.move
 
-        # Hunting
-        for prey, dist in self.in_proximity_accuracy().filter_kind(Prey):
-            if not prey.in_castle and dist < self.config.eating_radius:
+        # Hunting, from where the step took it
+        for prey, _ in preys:
+            if self.distance_to(prey) < self.config.eating_radius:
                 prey.kill()
                 TOTAL_PREY = max(0, TOTAL_PREY - 1)
                 self.has_eaten = True
@@ -171,7 +191,7 @@ for i in range(num_runs):
     TOTAL_PREY = 0  # Reset prey count before each run
 
     result_df = (
-        HeadlessSimulation(config=SimConfig(duration=60 * 60 * 1))
+        use_dormancy(use_torus_grid(HeadlessSimulation(config=SimConfig(duration=60 * 60 * 1))))
         .spawn_agent(Castle, images=["images/fort.png"])
         .batch_spawn_agents(50, Prey, images=["images/prey_small.png"])
         .batch_spawn_agents(25, Predator, images=["images/predator_small.png"])
@@ -0,0 +1,85 @@
+"""Level-of-detail rendering for large agent counts.
+
+Blitting one sprite per agent gets slow once there are thousands of them.
+After `use_lod_renderer(simulation, {"Prey": 2000})`, every kind of agent that
+has more agents on screen than its threshold is drawn as small squares of
+`glyph` pixels, written into the screen in one pass through
+`pygame.surfarray`. Kinds below their threshold, kinds without one, and
+obstacles and sites are still drawn as sprites.
+
+Thresholds and colours are keyed by class name. The colour of a kind defaults
+to the average colour of the visible pixels of its sprite. Headless simulations have no screen, so
+there the renderer is not installed at all.
+"""
+import itertools
+
+import numpy as np
+import pygame as pg
+
+
+def average_colour(image):
+    """Average colour of the visible pixels of an image, so a sprite's transparent background does not count."""
+    visible = pg.surfarray.array_alpha(image) > 0
+    if not visible.any():
+        return tuple(pg.transform.average_color(image))[:3]
+    return tuple(int(round(channel)) for channel in pg.surfarray.array3d(image)[visible].mean(axis=0))
+
+
+class LodRenderer:
+    def __init__(self, group, thresholds, colours=None, glyph=2):
+        self.group = group
+        self.thresholds = dict(thresholds)
+        self.colours = dict(colours or {})
+        self.glyph = glyph
+
+    def _colour(self, kind, sprite):
+        colour = self.colours.get(kind)
+        if colour is None:
+            colour = self.colours[kind] = average_colour(sprite._images[0])
+        return colour
+
+    def draw(self, surface):
+        by_kind = {}
+        for sprite in self.group.sprites():
+            by_kind.setdefault(type(sprite), []).append(sprite)
+
+        detailed, batched = [], []
+        for kind, sprites in by_kind.items():
+            kind = kind.__name__
+            threshold = self.thresholds.get(kind)
+            if threshold is None or len(sprites) <= threshold:
+                detailed.extend(sprites)
+            else:
+                batched.append((kind, sprites))
+
+        if batched:
+            pixels = pg.surfarray.pixels3d(surface)
+            width, height = pixels.shape[:2]
+            offset = self.glyph // 2
+            for kind, sprites in batched:
+                colour = self._colour(kind, sprites[0])
+                # Much faster than building an array out of (x, y) tuples
+                xy = np.fromiter(
+                    itertools.chain.from_iterable(sprite.pos for sprite in sprites), float, 2 * len(sprites)
+                ).reshape(-1, 2).astype(int) - offset
+                for dx in range(self.glyph):
+                    for dy in range(self.glyph):
+                        x, y = xy[:, 0] + dx, xy[:, 1] + dy
+                        visible = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+                        pixels[x[visible], y[visible]] = colour
+            # Unlock the screen before blitting onto it
+            del pixels
+
+        surface.blits([(sprite.image, sprite.rect) for sprite in detailed], doreturn=False)
+
+
+def use_lod_renderer(simulation, thresholds, colours=None, glyph=2):
+    """Draw kinds above their threshold (e.g. `{"Prey": 2000}`) as pixel glyphs, and return the simulation."""
+    if not hasattr(simulation, "_screen"):
+        return simulation
+
+    renderer = LodRenderer(simulation._all, thresholds, colours, glyph)
+    # Violet draws every sprite with `_all.draw(screen)` right before flipping the display
+    simulation._all.draw = renderer.draw
+    simulation.lod_renderer = renderer
+    return simulation